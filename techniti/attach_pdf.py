@@ -80,10 +80,12 @@ def on_submit_attach_pdf(doc, method):
     should_enqueue = config.get("enqueue", True)   # default: async
 
     if should_enqueue:
+        # After commit: the worker must be able to see the submitted doc.
         frappe.enqueue(
             "techniti.attach_pdf._generate_pdf_bg",
             queue="short",
             timeout=120,
+            enqueue_after_commit=True,
             doctype=doc.doctype,
             docname=doc.name,
             pdf_url_field=pdf_url_field,
@@ -0,0 +1,40 @@
+import click
+from frappe.commands import get_site, pass_context
+
+
+@click.command("whatsapp-dispatcher")
+@click.option(
+	"--concurrency",
+	default=10,
+	type=int,
+	help="Parallel Sparklebot requests per batch",
+)
+@click.option(
+	"--poll-interval",
+	default=1.0,
+	type=float,
+	help="Seconds to wait for a new-row notification before polling again",
+)
+@pass_context
+def whatsapp_dispatcher(context, concurrency, poll_interval):
+	"""Drain the WhatsApp Queue continuously instead of once a minute.
+
+	While it runs, the per-minute scheduler tick only recovers expired leases.
+	Stop with SIGTERM / Ctrl+C; the batch in flight is finished first.
+
+	Example:
+	    bench --site mysite whatsapp-dispatcher --concurrency 20
+	"""
+	import frappe
+
+	from techniti.techniti.doctype.whatsapp_queue.whatsapp_queue import run_dispatcher
+
+	frappe.init(site=get_site(context))
+	frappe.connect()
+	try:
+		run_dispatcher(concurrency=concurrency, poll_interval=poll_interval)
+	finally:
+		frappe.destroy()
+
+
+commands = [whatsapp_dispatcher]
@@ -163,13 +163,27 @@ doc_events = {
 	"Website Donation Subscription": {
 		"after_save": "techniti.api.update_website_expired_subscriptions"
 	},
+	# WhatsApp role recipients are cached per role
+	"User": {
+		"on_update": "techniti.whatsapp.whatsapp.clear_role_phone_cache",
+		"on_trash": "techniti.whatsapp.whatsapp.clear_role_phone_cache",
+	},
 	# WhatsApp notification handlers — fires for every doctype
 	"*": {
 		"on_submit":    "techniti.whatsapp.whatsapp.handle_whatsapp_notification_submit",
 		"after_save":   "techniti.whatsapp.whatsapp.handle_whatsapp_notification_save",
-		"on_cancel":    "techniti.whatsapp.whatsapp.handle_whatsapp_notification_cancel",
+		"on_cancel": [
+			"techniti.whatsapp.whatsapp.handle_whatsapp_notification_cancel",
+			"techniti.whatsapp.whatsapp.sync_reminder_schedule",
+		],
 		"after_insert": "techniti.whatsapp.whatsapp.handle_whatsapp_notification_creation",
-		"on_update":    "techniti.whatsapp.whatsapp.handle_whatsapp_notification_update"
+		"on_update": [
+			"techniti.whatsapp.whatsapp.handle_whatsapp_notification_update",
+			"techniti.whatsapp.whatsapp.sync_reminder_schedule",
+		],
+		# Keep WhatsApp Scheduled Send in step with reminder date fields
+		"on_update_after_submit": "techniti.whatsapp.whatsapp.sync_reminder_schedule",
+		"on_trash":               "techniti.whatsapp.whatsapp.sync_reminder_schedule",
 	}
 }
 # Scheduled Tasks
@@ -182,11 +196,22 @@ scheduler_events = {
 		"techniti.api.update_website_donor_categories",
 		"techniti.api.update_website_donor_status",
 	],
-	# WhatsApp Queue processor — runs every minute, like Email Queue
+	# WhatsApp Queue retention — archives / purges old Sent and Error rows
+	"daily_long": [
+		"techniti.techniti.doctype.whatsapp_queue.whatsapp_queue.purge_whatsapp_queue"
+	],
+	# WhatsApp Queue processor — runs every minute, like Email Queue.
+	# Stands down (lease recovery only) while `bench whatsapp-dispatcher` is running.
 	"all": [
-		"techniti.techniti.doctype.whatsapp_queue.whatsapp_queue.process_whatsapp_queue"
+		"techniti.techniti.doctype.whatsapp_queue.whatsapp_queue.process_whatsapp_queue",
+		# Applies buffered Sparklebot delivery-status callbacks
+		"techniti.whatsapp.whatsapp.apply_delivery_statuses",
+		# Fires due WhatsApp Scheduled Send rows (when enabled in WhatsApp Setting)
+		"techniti.whatsapp.whatsapp.process_reminder_schedule",
 	],
-	# WhatsApp scheduled reminders
+	# WhatsApp scheduled reminders — coordinators that fan the work out as
+	# per-notification / per-chunk jobs on the "whatsapp_reminders" queue
+	# (falls back to "long" when no worker is configured for it)
 	"cron": {
 		"00 11 * * *": [
 			"techniti.whatsapp.whatsapp.send_scheduled_whatsapp_reminders_enhanced"
@@ -0,0 +1,9 @@
+import frappe
+
+from techniti.techniti.doctype.whatsapp_queue.whatsapp_queue import on_doctype_update
+
+
+def execute():
+	# Rows queued before priority_rank existed
+	frappe.db.sql("UPDATE `tabWhatsApp Queue` SET priority_rank = -IFNULL(priority, 0)")
+	on_doctype_update()
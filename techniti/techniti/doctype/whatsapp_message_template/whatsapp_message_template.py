@@ -1,6 +1,16 @@
 import frappe
 from frappe.model.document import Document
 
+from techniti.whatsapp.whatsapp import clear_notification_cache
+
 
 class WhatsAppMessageTemplate(Document):
-    pass
+
+    def on_update(self):
+        clear_notification_cache()
+
+    def on_trash(self):
+        clear_notification_cache()
+
+    def after_rename(self, old, new, merge=False):
+        clear_notification_cache()
@@ -1,6 +1,31 @@
 import frappe
 from frappe.model.document import Document
 
+from techniti.whatsapp.whatsapp import (
+    clear_notification_cache,
+    clear_reminder_schedule,
+    reminder_schedule_enabled,
+)
+
 
 class WhatsAppNotification(Document):
-    pass
+
+    def on_update(self):
+        clear_notification_cache()
+
+        before = self.get_doc_before_save()
+        was_reminder = bool(before and before.event == "Scheduled Reminder")
+        if (self.event == "Scheduled Reminder" or was_reminder) and reminder_schedule_enabled():
+            frappe.enqueue(
+                "techniti.whatsapp.whatsapp.rebuild_reminder_schedule",
+                queue="long",
+                enqueue_after_commit=True,
+                notification=self.name,
+            )
+
+    def on_trash(self):
+        clear_notification_cache()
+        clear_reminder_schedule(self.name)
+
+    def after_rename(self, old, new, merge=False):
+        clear_notification_cache()
@@ -0,0 +1,163 @@
+# Copyright (c) 2026, Rohan Rambhiya and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from techniti.techniti.doctype.whatsapp_queue.whatsapp_queue import (
+	DRAIN_QUERY,
+	process_whatsapp_queue,
+)
+from techniti.whatsapp.whatsapp import (
+	_DEDUP_KEY_FIELDS,
+	CIRCUIT_FAILURE_THRESHOLD,
+	STATUS_BUFFER_KEY,
+	SparklebotHandler,
+	_recent_queue_filters,
+	apply_delivery_statuses,
+	buffer_delivery_statuses,
+)
+
+# Rows seeded so the optimizer has a realistic table to choose an index for:
+# mostly sent history, a few due rows
+SEED_ROWS = 2000
+SEED_DUE_EVERY = 50
+
+
+class TestWhatsAppQueue(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		now = frappe.utils.now_datetime()
+		frappe.db.bulk_insert(
+			"WhatsApp Queue",
+			(
+				"name", "creation", "modified", "owner", "modified_by", "status", "phone",
+				"message_type", "reference_doctype", "reference_name", "notification",
+				"trigger_event", "priority", "priority_rank", "retry",
+			),
+			[
+				(
+					f"test-wq-{i:05d}", now, now, "Administrator", "Administrator",
+					"Not Sent" if i % SEED_DUE_EVERY == 0 else "Sent",
+					f"91{9000000000 + i}", "text", "Website Donation", f"WDON-{i:05d}",
+					"Receipt", "Submit", 1, -1, 0,
+				)
+				for i in range(SEED_ROWS)
+			],
+		)
+
+	def test_drain_query_uses_claim_index(self):
+		plan = frappe.db.sql(
+			f"EXPLAIN {DRAIN_QUERY}",
+			{"now": frappe.utils.now_datetime(), "limit": 50},
+			as_dict=True,
+		)
+		self.assertIn("claim_index", _used_keys(plan))
+		# A filesort would make FOR UPDATE SKIP LOCKED lock every due row
+		for row in plan:
+			self.assertNotIn("Using filesort", row.get("Extra") or "")
+
+	def test_dedup_lookup_uses_dedup_index(self):
+		keys = [
+			("Website Donation", "WDON-00001", "Receipt", "919000000001", "Submit"),
+			("Website Donation", "WDON-00002", "Receipt", "919000000002", "Submit"),
+		]
+		query = frappe.get_all(
+			"WhatsApp Queue",
+			filters=_recent_queue_filters(keys),
+			fields=list(_DEDUP_KEY_FIELDS),
+			run=0,
+		)
+		plan = frappe.db.sql(f"EXPLAIN {query}", as_dict=True)
+		self.assertIn("dedup_index", _used_keys(plan))
+
+
+def _used_keys(plan):
+	"""Indexes EXPLAIN says the query reads (the key column, not merely possible_keys)"""
+	return {row.get("key") for row in plan}
+
+
+class TestDeliveryStatuses(FrappeTestCase):
+	def setUp(self):
+		now = frappe.utils.now_datetime()
+		self.wamids = [f"wamid.test-{i}" for i in range(3)]
+		frappe.db.bulk_insert(
+			"WhatsApp Queue",
+			(
+				"name", "creation", "modified", "owner", "modified_by", "status", "phone",
+				"message_type", "wamid",
+			),
+			[
+				(f"test-ds-{i}", now, now, "Administrator", "Administrator", "Sent",
+				 f"91800000000{i}", "text", wamid)
+				for i, wamid in enumerate(self.wamids)
+			],
+		)
+		frappe.db.commit()
+
+	def tearDown(self):
+		frappe.db.delete("WhatsApp Queue", {"name": ["like", "test-ds-%"]})
+		frappe.db.commit()
+		cache = frappe.cache()
+		cache.delete(cache.make_key(STATUS_BUFFER_KEY))
+
+	def test_buffer_drains_to_empty(self):
+		buffer_delivery_statuses(
+			[{"wamid": wamid, "status": "sent"} for wamid in self.wamids]
+			+ [{"wamid": wamid, "status": "delivered"} for wamid in self.wamids]
+		)
+		cache = frappe.cache()
+		self.assertEqual(cache.llen(STATUS_BUFFER_KEY), 6)
+
+		apply_delivery_statuses()
+
+		self.assertEqual(cache.llen(STATUS_BUFFER_KEY), 0)
+		self.assertEqual(
+			set(frappe.get_all("WhatsApp Queue", {"wamid": ["in", self.wamids]}, pluck="delivery_status")),
+			{"delivered"},
+		)
+
+
+class TestCircuitBreaker(FrappeTestCase):
+	settings = frappe._dict(
+		enabled=1,
+		api_base_url="https://sparklebot.invalid",
+		api_token="test",
+		tenant_slug="test-circuit-breaker",
+	)
+
+	def setUp(self):
+		patcher = patch("techniti.whatsapp.whatsapp.safe_get_settings", return_value=self.settings)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.handler = SparklebotHandler()
+		self.addCleanup(self._clear_breaker)
+
+		# A due row, so an un-paused tick would fan out a drain job
+		now = frappe.utils.now_datetime()
+		frappe.db.bulk_insert(
+			"WhatsApp Queue",
+			("name", "creation", "modified", "owner", "modified_by", "status", "phone", "message_type"),
+			[("test-cb-0", now, now, "Administrator", "Administrator", "Not Sent", "918000000000", "text")],
+		)
+
+	def _clear_breaker(self):
+		frappe.db.delete("WhatsApp Queue", {"name": "test-cb-0"})
+		frappe.db.commit()
+		frappe.cache().delete(
+			*(self.handler._redis_key(kind) for kind in ("circuit_open", "circuit_failures", "circuit_probe"))
+		)
+
+	def test_failures_open_the_circuit_and_pause_the_drain(self):
+		outage = frappe._dict(ok=False, transport_error=True, throttled=False, status_code=None, error="down")
+		for _ in range(CIRCUIT_FAILURE_THRESHOLD):
+			self.handler.record_circuit_result(outage)
+
+		self.assertEqual(self.handler.get_circuit_state(), "open")
+
+		with patch("frappe.enqueue") as enqueue:
+			process_whatsapp_queue()
+		enqueue.assert_not_called()
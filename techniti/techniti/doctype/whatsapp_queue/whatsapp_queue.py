@@ -1,4 +1,12 @@
+import itertools
 import json
+import math
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import frappe
 from frappe.model.document import Document
 
@@ -6,90 +14,186 @@ MAX_RETRY = 3
 # Delay in minutes before each retry attempt: 1st retry after 5 min, 2nd after 10 min
 RETRY_DELAYS = [5, 10]
 
+# Rows leased to a drain job per claim
+BATCH_SIZE = 50
+# Parallel HTTP requests per drain job (the pooled session grows to match)
+SEND_CONCURRENCY = 10
+# Upper bound on drain jobs the scheduler tick fans out to the RQ workers
+DRAIN_JOBS = 4
+# Seconds a drain job keeps claiming new batches before handing over to the next tick
+DRAIN_TIME_BUDGET = 50
+# Pause before re-claiming when a claim came back empty while due rows remain
+# (another drain job held them for its own claim)
+CLAIM_BACKOFF_SECONDS = 0.5
+# A claimed row still in Sending after this many minutes is assumed orphaned
+# (worker killed mid-batch) and is returned to the queue
+LEASE_MINUTES = 10
+
+# Template rows whose header PDF is not written yet are re-checked every
+# HEADER_RETRY_SECONDS without spending a retry, for up to HEADER_WAIT_MINUTES
+HEADER_RETRY_SECONDS = 60
+HEADER_WAIT_MINUTES = 30
+
+# Rows archived / deleted per transaction by the retention job
+PURGE_CHUNK_SIZE = 1000
+
+# Hot query behind every claim — served by the "claim_index" composite index,
+# whose column order matches the ORDER BY so the scan stops at LIMIT
+DRAIN_QUERY = """
+    SELECT name FROM `tabWhatsApp Queue`
+    WHERE status = 'Not Sent'
+      AND (send_after IS NULL OR send_after <= %(now)s)
+    ORDER BY priority_rank ASC, retry ASC, creation ASC
+    LIMIT %(limit)s
+"""
+
+# Redis list pushed after new rows commit, so an idle dispatcher wakes at once
+NOTIFY_KEY = "whatsapp_queue:notify"
+# Set by a running dispatcher; while present the scheduler tick does not drain
+HEARTBEAT_KEY = "whatsapp_queue:dispatcher"
+HEARTBEAT_SECONDS = 30
+
+
+class HeaderDocumentPending(Exception):
+    """The template needs a header document the source has not produced yet"""
+
 
 class WhatsAppQueue(Document):
 
-    def send(self):
+    def validate(self):
+        self.priority_rank = -frappe.utils.cint(self.priority)
+
+    def after_insert(self):
+        notify_dispatcher()
+
+    def send(self, handler=None):
         """
         Attempt to send this queued message via the Sparklebot API.
         Updates status to Sent on success, or reschedules/marks Error on failure.
-        Called by process_whatsapp_queue() scheduler.
+        send_batch() runs the same steps for a whole claimed batch but writes
+        every row's outcome back in a single statement.
         """
-        from techniti.whatsapp.whatsapp import SparklebotHandler
+        # Rows handed out by claim_batch() are already leased as Sending
+        if self.status != "Sending":
+            self.db_set("status", "Sending", commit=True)
+
+        try:
+            handler = handler or _get_handler()
+            url, payload = self._build_request(handler)
+        except HeaderDocumentPending:
+            _defer([self], HEADER_RETRY_SECONDS)
+            return False
+        except Exception as e:
+            self._handle_failure(str(e))
+            return False
+
+        result = handler.post(url, payload)
+        if result.throttled:
+            _defer([self], handler.pause_sending(result.retry_after))
+            return False
+        if handler.record_circuit_result(result) and handler.is_outage(result):
+            _defer([self], handler.get_circuit_open_seconds())
+            return False
+
+        values = self._outcome_values(handler, result)
+        if self.flags.header_url_refreshed:
+            values["header_document_url"] = self.header_document_url
+        self.db_set(values, commit=True)
+        return values["status"] == "Sent"
 
+    def _build_request(self, handler):
+        """Return the (url, payload) to POST for this row. Raises if it cannot be sent."""
         # Always refresh the header URL from the source document before sending.
         # This handles the case where the queue entry was created before the PDF
         # was ready — retries will automatically pick up the URL once available.
-        header_url = self.header_document_url or self._get_fresh_header_url()
+        header_url = self.header_document_url
+        if not header_url and self.message_type == "template":
+            header_url = self._get_fresh_header_url()
         if header_url and header_url != self.header_document_url:
-            self.db_set("header_document_url", header_url)
+            self.header_document_url = header_url
+            self.flags.header_url_refreshed = True
 
-        self.db_set("status", "Sending", commit=True)
-        try:
-            handler = SparklebotHandler()
-
-            if self.message_type == "template":
-                try:
-                    params = json.loads(self.field_params or "{}")
-                except Exception:
-                    params = {}
-                success = handler.send_template(
-                    self.phone,
-                    self.template_name,
-                    self.template_language or "en",
-                    params,
-                    self.reference_doctype,
-                    self.reference_name,
-                    header_document_url=header_url or None,
-                )
-            else:
-                success = handler.send_text(
-                    self.phone,
-                    self.message,
-                    self.reference_doctype,
-                    self.reference_name,
-                )
+        if self.message_type == "template":
+            try:
+                params = json.loads(self.field_params or "{}")
+            except Exception:
+                params = {}
+            return handler.template_request(
+                self.phone,
+                self.template_name,
+                self.template_language or "en",
+                params,
+                header_document_url=header_url or None,
+            )
 
-            if success:
-                self.db_set("status", "Sent", commit=True)
-                return True
-            else:
-                self._handle_failure("API returned failure — see Error Log for details")
-                return False
+        return handler.text_request(self.phone, self.message)
 
+    def _outcome_values(self, handler, result):
+        """
+        _result_values(), never raising: once Sparklebot has accepted the
+        message the row is written back as Sent even if logging the result
+        fails, so an expired lease can not send it a second time.
+        """
+        try:
+            return self._result_values(handler, result)
         except Exception as e:
-            self._handle_failure(str(e))
-            return False
+            frappe.log_error(
+                title="WhatsApp Queue Processor Error",
+                message=f"Queue entry: {self.name}\n{str(e)}"
+            )
+            if result.ok:
+                return {"status": "Sent", "wamid": result.wamid, "lease_until": None}
+            return self._failure_values(str(e))
+
+    def _result_values(self, handler, result):
+        """Column values recording the outcome of handler.post() for this row"""
+        success = handler.log_result(
+            result, self.phone, self.reference_doctype, self.reference_name,
+            template_name=self.template_name if self.message_type == "template" else None,
+        )
+        if success:
+            return {"status": "Sent", "wamid": result.wamid, "lease_until": None}
+
+        return self._failure_values(
+            result.error or "API returned failure — see Error Log for details"
+        )
 
     def _get_fresh_header_url(self):
         """
         Look up the current value of the template's header_document_field on the
         source document. Used to recover when the queue entry was created before
         the PDF was committed (e.g. race between PDF job and WhatsApp job).
+
+        Raises HeaderDocumentPending while the template expects a header
+        document that the source has not got yet, so the row is deferred
+        instead of being sent without it.
         """
-        try:
-            if not self.notification or not self.reference_doctype or not self.reference_name:
-                return None
-            notification = frappe.get_doc("WhatsApp Notification", self.notification)
-            if not notification.message:
-                return None
-            template = frappe.get_doc("WhatsApp Message Template", notification.message)
-            if not template.header_document_field:
-                return None
-            doc = frappe.get_doc(self.reference_doctype, self.reference_name)
-            return doc.get(template.header_document_field) or None
-        except Exception:
+        from techniti.whatsapp.whatsapp import get_header_document_field
+
+        if not self.notification or not self.reference_doctype or not self.reference_name:
             return None
 
+        header_field = get_header_document_field(self.notification)
+        if not header_field:
+            return None
+
+        header_url = frappe.db.get_value(self.reference_doctype, self.reference_name, header_field)
+        if header_url:
+            return header_url
+
+        waited = frappe.utils.time_diff_in_seconds(frappe.utils.now_datetime(), self.creation)
+        if waited < HEADER_WAIT_MINUTES * 60:
+            raise HeaderDocumentPending
+        frappe.throw(f"Header document ({header_field}) still empty after {HEADER_WAIT_MINUTES} minutes")
+
     def _handle_failure(self, error_msg):
         """Increment retry counter. Reschedule if under limit, else mark Error."""
+        self.db_set(self._failure_values(error_msg), commit=True)
+
+    def _failure_values(self, error_msg):
+        """Column values for a failed attempt; logs the final failure once retries run out."""
         retry = (self.retry or 0) + 1
         if retry >= MAX_RETRY:
-            self.db_set({
-                "status": "Error",
-                "retry": retry,
-                "error": str(error_msg)[:2000],
-            }, commit=True)
             frappe.log_error(
                 title=f"WhatsApp Queue — Final Failure ({self.reference_doctype})",
                 message=(
@@ -97,52 +201,472 @@ class WhatsAppQueue(Document):
                     f"Doc: {self.reference_name} | Phone: {self.phone}\n{error_msg}"
                 )
             )
-        else:
-            delay_minutes = RETRY_DELAYS[retry - 1] if (retry - 1) < len(RETRY_DELAYS) else 10
-            send_after = frappe.utils.add_to_date(
-                frappe.utils.now_datetime(), minutes=delay_minutes
-            )
-            self.db_set({
-                "status": "Not Sent",
+            return {
+                "status": "Error",
                 "retry": retry,
                 "error": str(error_msg)[:2000],
-                "send_after": send_after,
-            }, commit=True)
+                "lease_until": None,
+            }
+
+        delay_minutes = RETRY_DELAYS[retry - 1] if (retry - 1) < len(RETRY_DELAYS) else 10
+        send_after = frappe.utils.add_to_date(
+            frappe.utils.now_datetime(), minutes=delay_minutes
+        )
+        return {
+            "status": "Not Sent",
+            "retry": retry,
+            "error": str(error_msg)[:2000],
+            "send_after": send_after,
+            "lease_until": None,
+        }
+
+
+def on_doctype_update():
+    """
+    Composite indexes for the hot queries (also applied by patches).
+
+    claim_index serves DRAIN_QUERY: the ORDER BY columns follow status, all
+    ascending (priority_rank is the negated priority — descending index
+    parts are ignored before MariaDB 10.8), so SKIP LOCKED claims read and
+    lock only the rows they return instead of filesorting every due row;
+    send_after is filtered from the index. It replaces drain_index, whose send_after
+    prefix forced that filesort. dedup_index serves the 10-minute
+    double-send lookup in techniti.whatsapp.whatsapp._recent_queue_keys
+    (the pre-insert check for keys not marked in Redis);
+    status is left out of it because five varchar(140) columns plus status
+    would exceed InnoDB's 3072-byte key limit under utf8mb4 — it is filtered
+    from the few rows the prefix leaves.
+    """
+    if frappe.db.has_index("tabWhatsApp Queue", "drain_index"):
+        frappe.db.sql_ddl("ALTER TABLE `tabWhatsApp Queue` DROP INDEX `drain_index`")
+    frappe.db.add_index(
+        "WhatsApp Queue",
+        ["status", "priority_rank", "retry", "creation", "send_after"],
+        "claim_index",
+    )
+    frappe.db.add_index(
+        "WhatsApp Queue",
+        ["reference_doctype", "reference_name", "notification", "phone", "trigger_event", "creation"],
+        "dedup_index",
+    )
+    frappe.db.add_index("WhatsApp Queue", ["status", "modified"], "retention_index")
 
 
 def process_whatsapp_queue():
     """
     Scheduler entry point (runs every minute via hooks 'all' event).
-    Fetches all pending WhatsApp Queue entries whose send_after has passed
-    and attempts to send them.
+    Returns orphaned leases to the queue and fans the pending backlog out to
+    up to DRAIN_JOBS parallel drain_whatsapp_queue() jobs.
     """
     if not _is_whatsapp_enabled():
         return
 
-    rows = frappe.db.sql(
+    release_expired_leases()
+
+    if frappe.cache().get_value(HEARTBEAT_KEY):
+        return  # bench whatsapp-dispatcher is draining continuously
+
+    if _sending_paused(_get_handler()):
+        return  # throttled or circuit open — nothing would be sent
+
+    pending = frappe.db.sql(
         """
-        SELECT name FROM `tabWhatsApp Queue`
+        SELECT COUNT(*) FROM `tabWhatsApp Queue`
         WHERE status = 'Not Sent'
           AND (send_after IS NULL OR send_after <= %(now)s)
-        ORDER BY priority DESC, retry ASC, creation ASC
-        LIMIT 50
         """,
         {"now": frappe.utils.now_datetime()},
-        as_dict=True,
+    )[0][0]
+    if not pending:
+        return
+
+    # Fixed job ids + deduplicate: a drain job still running from the previous
+    # tick keeps its slot instead of being doubled up.
+    for slot in range(min(DRAIN_JOBS, math.ceil(pending / BATCH_SIZE))):
+        frappe.enqueue(
+            "techniti.techniti.doctype.whatsapp_queue.whatsapp_queue.drain_whatsapp_queue",
+            queue="short",
+            timeout=300,
+            job_id=f"whatsapp_queue_drain::{slot}",
+            deduplicate=True,
+        )
+
+
+def drain_whatsapp_queue(time_budget=DRAIN_TIME_BUDGET):
+    """
+    RQ worker: claim and send batches until the queue is empty or the time
+    budget runs out. Any number of these can run at once — claim_batch()
+    guarantees each row is handed to exactly one of them.
+    """
+    handler = _get_handler()
+    deadline = time.monotonic() + time_budget
+    while time.monotonic() < deadline:
+        if _sending_paused(handler):
+            break  # the next tick picks up once the pause / outage is over
+        names = claim_batch()
+        if names:
+            send_batch(names, handler=handler)
+            continue
+        if not _has_due_rows():
+            break
+        # Another job's claim was holding the due rows — try again shortly
+        time.sleep(CLAIM_BACKOFF_SECONDS)
+
+
+def run_dispatcher(concurrency=SEND_CONCURRENCY, poll_interval=1.0):
+    """
+    Long-running drain loop behind `bench whatsapp-dispatcher`.
+
+    Claims and sends batches back to back while there is work, then blocks on
+    NOTIFY_KEY for up to *poll_interval* seconds (which also picks up rows
+    whose send_after has just passed). SIGTERM / SIGINT stop the loop after
+    the batch in flight has been written back.
+    """
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda signum, frame: stop.set())
+
+    cache = frappe.cache()
+    notify_key = cache.make_key(NOTIFY_KEY)
+    frappe.logger("whatsapp").info(
+        f"WhatsApp dispatcher started | pid:{os.getpid()} | concurrency:{concurrency}"
+    )
+
+    while not stop.is_set():
+        # Per-request cache memo (Redis reads such as the WhatsApp Setting
+        # version stamp) — reset every loop, as a request would, so settings
+        # changes reach this long-lived process
+        frappe.local.cache = {}
+        cache.set_value(HEARTBEAT_KEY, os.getpid(), expires_in_sec=HEARTBEAT_SECONDS)
+        try:
+            handler = _get_handler() if _is_whatsapp_enabled() else None
+            if handler and not _sending_paused(handler):
+                names = claim_batch()
+                if names:
+                    send_batch(names, concurrency=concurrency, handler=handler)
+                    continue
+        except Exception:
+            frappe.db.rollback()
+            frappe.log_error(title="WhatsApp Dispatcher Error")
+            stop.wait(poll_interval)
+            continue
+
+        try:
+            if cache.blpop(notify_key, timeout=max(1, round(poll_interval))):
+                cache.delete(notify_key)  # one wake-up covers every pending insert
+        except Exception:
+            stop.wait(poll_interval)
+
+    cache.delete_value(HEARTBEAT_KEY)
+    frappe.logger("whatsapp").info(f"WhatsApp dispatcher stopped | pid:{os.getpid()}")
+
+
+def notify_dispatcher():
+    """Wake an idle dispatcher once the current transaction commits (once per transaction)."""
+    if frappe.flags.whatsapp_dispatcher_notify:
+        return
+    frappe.flags.whatsapp_dispatcher_notify = True
+    frappe.db.after_commit.add(_push_notification)
+    frappe.db.after_rollback.add(_reset_notification)
+
+
+def _push_notification():
+    _reset_notification()
+    try:
+        # Raw commands on the site key the dispatcher BLPOPs — the
+        # RedisWrapper list helpers would prefix it a second time
+        cache = frappe.cache()
+        key = cache.make_key(NOTIFY_KEY)
+        pipe = cache.pipeline()
+        pipe.lpush(key, 1)
+        pipe.ltrim(key, 0, 0)
+        pipe.execute()
+    except Exception:
+        pass  # no dispatcher wake-up — it still polls every second
+
+
+def _reset_notification():
+    frappe.flags.whatsapp_dispatcher_notify = False
+
+
+def claim_batch(limit=BATCH_SIZE):
+    """
+    Lease up to *limit* due rows to the calling worker and return their names.
+
+    SELECT ... FOR UPDATE SKIP LOCKED makes concurrent claimers pass over rows
+    another transaction is already claiming, and flipping them to Sending in
+    the same transaction keeps them out of every later drain query.
+    """
+    now = frappe.utils.now_datetime()
+    names = frappe.db.sql_list(
+        f"{DRAIN_QUERY} FOR UPDATE SKIP LOCKED", {"now": now, "limit": limit}
     )
+    if names:
+        frappe.db.sql(
+            """
+            UPDATE `tabWhatsApp Queue`
+            SET status = 'Sending', lease_until = %(lease_until)s, modified = %(now)s
+            WHERE name IN %(names)s
+            """,
+            {
+                "names": tuple(names),
+                "now": now,
+                "lease_until": frappe.utils.add_to_date(now, minutes=LEASE_MINUTES),
+            },
+        )
+    frappe.db.commit()
+    return names
+
+
+def _has_due_rows():
+    """Whether any committed row is due (plain read — ignores claim locks)"""
+    return bool(frappe.db.sql(
+        DRAIN_QUERY, {"now": frappe.utils.now_datetime(), "limit": 1}
+    ))
 
+
+def send_batch(names, concurrency=SEND_CONCURRENCY, handler=None):
+    """
+    Send claimed rows in parallel and write every outcome back at once.
+
+    Rows are loaded with one query and their requests built on this thread;
+    only handler.post() — plain HTTP over the pooled session — runs in the
+    thread pool. Sent / retry / error / send_after for the whole batch then
+    go out in one UPDATE and one commit instead of a commit per row.
+    """
+    from techniti.whatsapp.whatsapp import (
+        CIRCUIT_FAILURE_THRESHOLD,
+        REQUEST_TIMEOUT,
+        ensure_http_pool_size,
+    )
+
+    ensure_http_pool_size(concurrency)
+    try:
+        handler = handler or _get_handler()
+    except Exception as e:
+        frappe.log_error(title="WhatsApp Queue Processor Error", message=str(e))
+        return
+
+    outcomes = {}
+    prepared = []
+    rows = frappe.get_all(
+        "WhatsApp Queue",
+        filters={"name": ["in", names]},
+        fields=["*"],
+        order_by="priority_rank asc, retry asc, creation asc",
+    )
     for row in rows:
+        doc = frappe.get_doc({"doctype": "WhatsApp Queue", **row})
         try:
-            doc = frappe.get_doc("WhatsApp Queue", row.name)
-            # Re-check status after fetch to avoid race with parallel workers
-            if doc.status == "Not Sent":
-                doc.send()
+            url, payload = doc._build_request(handler)
+        except HeaderDocumentPending:
+            outcomes.update(_deferred_values([doc], HEADER_RETRY_SECONDS))
+            continue
+        except Exception as e:
+            outcomes[doc.name] = doc._failure_values(str(e))
+            continue
+        prepared.append((doc, url, payload))
+
+    # Circuit breaker: nothing goes out while it is open, and only a single
+    # probe message while it is half-open.
+    circuit = handler.get_circuit_state()
+    if circuit == "closed":
+        sendable, held_back = prepared, []
+    elif circuit == "half-open" and handler.acquire_circuit_probe():
+        sendable, held_back = prepared[:1], [doc for doc, _url, _payload in prepared[1:]]
+    else:
+        sendable, held_back = [], [doc for doc, _url, _payload in prepared]
+
+    # A 429, or a run of transport failures, seen by the send threads stops
+    # further submissions; whatever has not been posted yet goes back to the
+    # queue untouched.
+    stop = threading.Event()
+    outages = itertools.count(1)
+
+    def post(url, payload):
+        result = handler.post(url, payload)
+        if result.throttled or (
+                handler.is_outage(result) and next(outages) >= CIRCUIT_FAILURE_THRESHOLD):
+            stop.set()
+        return result
+
+    submitted = []
+    if sendable:
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(sendable))) as pool:
+            for doc, url, payload in sendable:
+                if stop.is_set() or not handler.acquire_send_slot():
+                    held_back.append(doc)
+                    continue
+                submitted.append((doc, pool.submit(post, url, payload)))
+
+    results = [(doc, future.result()) for doc, future in submitted]
+    circuit_open = False
+    for _doc, result in results:
+        circuit_open = handler.record_circuit_result(result) or circuit_open
+
+    pause_seconds = 0
+    for doc, result in results:
+        try:
+            if result.throttled:
+                pause_seconds = max(pause_seconds, handler.pause_sending(result.retry_after))
+                held_back.append(doc)
+                continue
+            if circuit_open and handler.is_outage(result):
+                # Sparklebot is down, not this message: keep its retries and
+                # stay out of the Error Log.
+                held_back.append(doc)
+                continue
+            outcomes[doc.name] = doc._outcome_values(handler, result)
         except Exception as e:
             frappe.log_error(
                 title="WhatsApp Queue Processor Error",
-                message=f"Queue entry: {row.name}\n{str(e)}"
+                message=f"Queue entry: {doc.name}\n{str(e)}"
             )
 
+    if held_back:
+        outcomes.update(_deferred_values(
+            held_back,
+            pause_seconds
+            or handler.get_pause_seconds()
+            or handler.get_circuit_open_seconds()
+            or REQUEST_TIMEOUT
+        ))
+
+    for doc, _url, _payload in prepared:
+        if doc.flags.header_url_refreshed and doc.name in outcomes:
+            outcomes[doc.name]["header_document_url"] = doc.header_document_url
+
+    write_back(outcomes)
+
+
+def write_back(outcomes):
+    """
+    Apply {name: {column: value}} for many rows with one multi-row UPDATE.
+    Columns a row does not mention keep their current value.
+    """
+    if not outcomes:
+        return
+
+    columns = sorted({column for values in outcomes.values() for column in values})
+    assignments, params = [], []
+    for column in columns:
+        cases = []
+        for name, values in outcomes.items():
+            if column in values:
+                cases.append("WHEN %s THEN %s")
+                params.extend([name, values[column]])
+        assignments.append(f"`{column}` = CASE name {' '.join(cases)} ELSE `{column}` END")
+
+    params.append(frappe.utils.now_datetime())
+    params.extend(outcomes)
+    frappe.db.sql(
+        f"""
+        UPDATE `tabWhatsApp Queue`
+        SET {', '.join(assignments)}, modified = %s
+        WHERE name IN ({', '.join(['%s'] * len(outcomes))})
+        """,
+        params,
+    )
+    frappe.db.commit()
+
+
+def _defer(docs, seconds):
+    """Return rows to Not Sent after a throttle pause without spending a retry."""
+    write_back(_deferred_values(docs, seconds))
+
+
+def _deferred_values(docs, seconds):
+    send_after = frappe.utils.add_to_date(
+        frappe.utils.now_datetime(), seconds=math.ceil(seconds)
+    )
+    return {
+        doc.name: {"status": "Not Sent", "send_after": send_after, "lease_until": None}
+        for doc in docs
+    }
+
+
+def release_expired_leases():
+    """Return rows whose drain job died mid-batch to Not Sent."""
+    frappe.db.sql(
+        """
+        UPDATE `tabWhatsApp Queue`
+        SET status = 'Not Sent', lease_until = NULL
+        WHERE status = 'Sending' AND lease_until < %(now)s
+        """,
+        {"now": frappe.utils.now_datetime()},
+    )
+    frappe.db.commit()
+
+
+def purge_whatsapp_queue():
+    """
+    Daily retention job. Sent and Error rows older than the retention set in
+    WhatsApp Setting are copied into WhatsApp Queue Archive (optional) and
+    deleted, PURGE_CHUNK_SIZE rows per transaction so no lock is held long.
+    """
+    from techniti.whatsapp.whatsapp import safe_get_settings
+
+    settings = safe_get_settings()
+    if not settings:
+        return
+
+    for status, days in (
+        ("Sent", frappe.utils.cint(settings.sent_retention_days)),
+        ("Error", frappe.utils.cint(settings.error_retention_days)),
+    ):
+        if days <= 0:
+            continue
+        cutoff = frappe.utils.add_days(frappe.utils.now_datetime(), -days)
+        while True:
+            names = frappe.db.sql_list(
+                """
+                SELECT name FROM `tabWhatsApp Queue`
+                WHERE status = %(status)s AND modified < %(cutoff)s
+                LIMIT %(limit)s
+                """,
+                {"status": status, "cutoff": cutoff, "limit": PURGE_CHUNK_SIZE},
+            )
+            if not names:
+                break
+            if settings.archive_purged_rows:
+                _archive(names)
+            frappe.db.sql(
+                "DELETE FROM `tabWhatsApp Queue` WHERE name IN %(names)s",
+                {"names": tuple(names)},
+            )
+            frappe.db.commit()
+
+
+def _archive(names):
+    """Copy a compact record of each row (no message body / params) into the archive"""
+    frappe.db.sql(
+        """
+        INSERT IGNORE INTO `tabWhatsApp Queue Archive`
+            (name, creation, modified, modified_by, owner, docstatus,
+             status, phone, message_type, template_name,
+             reference_doctype, reference_name, notification, trigger_event,
+             retry, wamid, error)
+        SELECT
+            name, creation, modified, modified_by, owner, 0,
+            status, phone, message_type, LEFT(template_name, 140),
+            reference_doctype, reference_name, notification, trigger_event,
+            retry, LEFT(wamid, 140), LEFT(error, 500)
+        FROM `tabWhatsApp Queue`
+        WHERE name IN %(names)s
+        """,
+        {"names": tuple(names)},
+    )
+
+
+def _sending_paused(handler):
+    """True while Sparklebot throttles us (429) or the circuit breaker is open"""
+    return bool(handler.get_pause_seconds() or handler.get_circuit_state() == "open")
+
+
+def _get_handler():
+    from techniti.whatsapp.whatsapp import SparklebotHandler
+    return SparklebotHandler()
+
 
 def _is_whatsapp_enabled():
     try:
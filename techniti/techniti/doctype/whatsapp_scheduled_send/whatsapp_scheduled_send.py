@@ -0,0 +1,18 @@
+import frappe
+from frappe.model.document import Document
+
+
+class WhatsAppScheduledSend(Document):
+    pass
+
+
+def on_doctype_update():
+    """
+    (notification, fire_at) serves the per-notification due-row claim in
+    techniti.whatsapp.whatsapp.process_reminder_schedule; (reference_doctype,
+    reference_name) the per-document resync on save.
+    """
+    frappe.db.add_index("WhatsApp Scheduled Send", ["notification", "fire_at"], "due_index")
+    frappe.db.add_index(
+        "WhatsApp Scheduled Send", ["reference_doctype", "reference_name"], "reference_index"
+    )
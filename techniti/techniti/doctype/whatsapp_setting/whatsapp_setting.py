@@ -1,6 +1,18 @@
 import frappe
 from frappe.model.document import Document
 
+from techniti.whatsapp.whatsapp import clear_settings_cache
+
 
 class WhatsAppSetting(Document):
-    pass
+
+    def on_update(self):
+        clear_settings_cache()
+
+        # Backfill the schedule from existing documents when switching over
+        if self.use_reminder_schedule and self.has_value_changed("use_reminder_schedule"):
+            frappe.enqueue(
+                "techniti.whatsapp.whatsapp.rebuild_reminder_schedule",
+                queue="long",
+                enqueue_after_commit=True,
+            )
@@ -1,7 +1,17 @@
+import ast
+import hashlib
+import hmac
+import json
 import requests
+from requests.adapters import HTTPAdapter
 import frappe
 import re
+import threading
+import time as _time
+import unicodedata
+from functools import lru_cache, partial
 from frappe.utils import add_days, nowdate, date_diff, formatdate, now_datetime, add_to_date, get_datetime
+from frappe.utils.password import get_decrypted_password
 from datetime import datetime, time, timedelta
 
 
@@ -9,21 +19,162 @@ from datetime import datetime, time, timedelta
 # SETTINGS HELPER
 # ============================================================================
 
+# Redis version stamp for the per-process settings snapshot, bumped on save
+SETTINGS_VERSION_KEY = "whatsapp_setting_version"
+
+# {site: (version, settings snapshot)}
+_settings_snapshots = {}
+
+
 def safe_get_settings():
-    """Safely get WhatsApp Settings — returns None during install/migrate"""
-    if frappe.flags.in_install or frappe.flags.in_patch or frappe.flags.in_migrate:
-        return None
+    """
+    Safely get WhatsApp Settings — returns None during install/migrate.
 
-    if not frappe.db.exists("DocType", "WhatsApp Setting"):
+    Returns a read-only frappe._dict snapshot held per process and checked
+    against a version stamp in Redis (one cached GET per request — the
+    long-running dispatcher resets that memo every loop), so callers no
+    longer hit the DB; a save reloads it everywhere. Password fields are
+    masked — read them with get_decrypted_password.
+    """
+    if frappe.flags.in_install or frappe.flags.in_patch or frappe.flags.in_migrate:
         return None
 
     try:
-        return frappe.get_single("WhatsApp Setting")
+        cache = frappe.cache()
+        version = cache.get_value(SETTINGS_VERSION_KEY)
+        if not version:
+            version = frappe.generate_hash(length=10)
+            cache.set_value(SETTINGS_VERSION_KEY, version)
+
+        cached = _settings_snapshots.get(frappe.local.site)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        if not frappe.db.exists("DocType", "WhatsApp Setting"):
+            return None
+
+        settings = frappe._dict(frappe.get_single("WhatsApp Setting").as_dict())
+        _settings_snapshots[frappe.local.site] = (version, settings)
+        return settings
     except Exception as e:
         frappe.log_error(f"Could not load WhatsApp Settings: {e}", "WhatsApp Settings")
         return None
 
 
+def clear_settings_cache():
+    """WhatsApp Setting on_update: reload the snapshot in every process (again after commit)"""
+    _bump_settings_version()
+    frappe.db.after_commit.add(_bump_settings_version)
+
+
+def _bump_settings_version():
+    frappe.cache().set_value(SETTINGS_VERSION_KEY, frappe.generate_hash(length=10))
+
+
+# ============================================================================
+# HTTP SESSION
+# ============================================================================
+
+# Keep-alive connections kept per worker process (matches the queue send
+# pool); grown by ensure_http_pool_size() for a larger dispatcher concurrency
+HTTP_POOL_SIZE = 10
+REQUEST_TIMEOUT = 30
+
+# Circuit breaker: consecutive transport failures / 5xx before sending pauses,
+# and how long it stays open before a single half-open probe is allowed
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_OPEN_SECONDS = 60
+
+_session = None
+_session_lock = threading.Lock()
+_pool_size = HTTP_POOL_SIZE
+
+
+def get_http_session():
+    """Process-wide requests.Session so every send reuses pooled keep-alive connections"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                _mount_http_adapter(session, _pool_size)
+                _session = session
+    return _session
+
+
+def ensure_http_pool_size(size):
+    """
+    Keep at least *size* pooled connections, so *size* parallel senders never
+    overflow the pool (urllib3 would discard the extra connections and every
+    such request would open a new TLS connection).
+    """
+    global _pool_size
+    if size <= _pool_size:
+        return
+    with _session_lock:
+        if size <= _pool_size:
+            return
+        _pool_size = size
+        if _session is not None:
+            _mount_http_adapter(_session, size)
+
+
+def _mount_http_adapter(session, size):
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+
+# ============================================================================
+# RATE LIMITING
+# ============================================================================
+
+# Token bucket shared by every worker through Redis. Refills at `rate` tokens
+# per second up to `rate` tokens (one second of burst). Returns 0 when a token
+# was taken, otherwise the seconds to wait before the next one is available.
+_TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local now = tonumber(ARGV[2])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or rate
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(rate, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 60)
+return tostring(wait)
+"""
+
+_token_bucket = None
+
+
+def _get_token_bucket():
+    global _token_bucket
+    if _token_bucket is None:
+        _token_bucket = frappe.cache().register_script(_TOKEN_BUCKET_LUA)
+    return _token_bucket
+
+
+def _parse_retry_after(value):
+    """Retry-After is either delta-seconds or an HTTP date; returns seconds or None"""
+    if not value:
+        return None
+    try:
+        return max(0, int(float(value)))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0, int(parsedate_to_datetime(value).timestamp() - _time.time()))
+    except Exception:
+        return None
+
+
 # ============================================================================
 # SPARKLEBOT HANDLER
 # ============================================================================
@@ -111,32 +262,236 @@ class SparklebotHandler:
             header_document_url=header_document_url
         )
 
-    # ------------------------------------------------------------------
-    # Internal senders
-    # ------------------------------------------------------------------
+    def text_request(self, phone, message):
+        """
+        Return (url, payload) for a text message.
+        Raises if WhatsApp is not configured or the phone number is invalid.
+        """
+        return self._text_request(self._require_phone(phone), message)
 
-    def _send_text_message(self, phone, message, doctype, docname):
-        """POST to /messages/text"""
-        url = f"{self.base_url}/messages/text"
-        payload = {
-            "phone": phone,
-            "message": message
-        }
+    def template_request(self, phone, template_name, language, field_params,
+                         header_document_url=None):
+        """
+        Return (url, payload) for a template message.
+        Raises if WhatsApp is not configured or the phone number is invalid.
+        """
+        return self._template_request(
+            self._require_phone(phone), template_name, language, field_params,
+            header_document_url=header_document_url
+        )
 
+    def post(self, url, payload):
+        """
+        POST one message over the pooled session and parse the reply.
+        Touches nothing but the network, so it is safe to call from send-pool
+        threads; the caller hands the result to log_result() afterwards.
+        """
         try:
-            response = requests.post(url, json=payload, headers=self.headers, timeout=30)
-            return self._handle_response(response, phone, doctype, docname)
+            response = get_http_session().post(
+                url, json=payload, headers=self.headers, timeout=REQUEST_TIMEOUT
+            )
         except Exception as e:
+            return frappe._dict(ok=False, transport_error=True, throttled=False,
+                                status_code=None, wamid=None, error=str(e))
+        return self._parse_response(response)
+
+    def log_result(self, result, phone, doctype, docname, template_name=None):
+        """Record the outcome of post() in the logger / Error Log. Returns True on success."""
+        if result.ok:
+            frappe.logger("whatsapp").info(
+                f"WhatsApp sent | {doctype} | phone:{phone} | wamid:{result.wamid or 'N/A'}"
+            )
+            return True
+
+        if result.throttled:
+            frappe.logger("whatsapp").warning(
+                f"WhatsApp throttled | {doctype} | phone:{phone} | {result.error}"
+            )
+            return False
+
+        if result.transport_error:
+            if template_name:
+                frappe.log_error(
+                    title="WhatsApp Template Send Error",
+                    message=f"DocType: {doctype} | Template: {template_name} | Phone: {phone}\n{result.error}"
+                )
+            else:
+                frappe.log_error(
+                    title="WhatsApp Text Send Error",
+                    message=f"DocType: {doctype} | Phone: {phone}\n{result.error}"
+                )
+        elif result.status_code not in (200, 201):
             frappe.log_error(
-                title="WhatsApp Text Send Error",
-                message=f"DocType: {doctype} | Phone: {phone}\n{str(e)}"
+                title=f"WhatsApp HTTP Error - {doctype}",
+                message=f"Phone: {phone}\n{result.error}"
+            )
+        else:
+            frappe.log_error(
+                title=f"WhatsApp API Error - {doctype}",
+                message=f"Phone: {phone}\n{result.error}"
             )
+        return False
+
+    # ------------------------------------------------------------------
+    # Throughput control (shared across workers via Redis)
+    # ------------------------------------------------------------------
+
+    def acquire_send_slot(self):
+        """
+        Block until the tenant's token bucket grants one message.
+        Returns False without waiting if sending is paused after a 429.
+        """
+        rate = frappe.utils.cint(self.settings.get("messages_per_second"))
+        while True:
+            if self.get_pause_seconds():
+                return False
+            if rate <= 0:
+                return True
+            try:
+                wait = float(_get_token_bucket()(keys=[self._redis_key("rate")],
+                                                 args=[rate, _time.time()]))
+            except Exception:
+                return True  # Redis unavailable — fail open, Sparklebot still throttles us
+            if wait <= 0:
+                return True
+            _time.sleep(wait)
+
+    def pause_sending(self, seconds=None):
+        """Put every worker's queue drain to sleep for *seconds*"""
+        seconds = seconds or frappe.utils.cint(self.settings.get("throttle_pause_seconds")) or 60
+        try:
+            frappe.cache().set(self._redis_key("pause"), _time.time() + seconds, ex=int(seconds) + 1)
+        except Exception:
+            pass
+        return seconds
+
+    def get_pause_seconds(self):
+        """Seconds left on a throttle pause (0 when sending is allowed)"""
+        try:
+            until = frappe.cache().get(self._redis_key("pause"))
+        except Exception:
+            return 0
+        if not until:
+            return 0
+        return max(0, float(until) - _time.time())
+
+    def get_circuit_state(self):
+        """
+        'closed', 'open' or 'half-open', shared by every worker through Redis.
+        Half-open means the open period has lapsed but no send has succeeded
+        yet; the next sender may fire one probe message.
+        """
+        # Raw GETs: the breaker keys are written unprefixed (see _redis_key),
+        # which RedisWrapper.exists would prefix
+        try:
+            cache = frappe.cache()
+            if cache.get(self._redis_key("circuit_open")) is not None:
+                return "open"
+            failures = int(cache.get(self._redis_key("circuit_failures")) or 0)
+            if failures < CIRCUIT_FAILURE_THRESHOLD:
+                return "closed"
+            # Another worker's probe is in flight — wait for its verdict
+            if cache.get(self._redis_key("circuit_probe")) is not None:
+                return "open"
+        except Exception:
+            return "closed"
+        return "half-open"
+
+    def get_circuit_open_seconds(self):
+        try:
+            return max(0, frappe.cache().ttl(self._redis_key("circuit_open")) or 0)
+        except Exception:
+            return 0
+
+    def acquire_circuit_probe(self):
+        """In half-open state, let exactly one worker send a probe message"""
+        try:
+            return bool(frappe.cache().set(
+                self._redis_key("circuit_probe"), 1, nx=True, ex=REQUEST_TIMEOUT + 5
+            ))
+        except Exception:
+            return True
+
+    def record_circuit_result(self, result):
+        """
+        Feed one post() result into the breaker. Any reply that shows Sparklebot
+        is reachable closes it; a transport failure or 5xx counts towards
+        opening it. Returns True while the breaker is open.
+        """
+        failures_key = self._redis_key("circuit_failures")
+        try:
+            cache = frappe.cache()
+            if not self.is_outage(result):
+                if int(cache.get(failures_key) or 0) >= CIRCUIT_FAILURE_THRESHOLD:
+                    frappe.logger("whatsapp").info("WhatsApp circuit closed — Sparklebot reachable again")
+                cache.delete(failures_key, self._redis_key("circuit_probe"))
+                return False
+
+            failures = cache.incr(failures_key)
+            cache.expire(failures_key, 86400)
+            if failures < CIRCUIT_FAILURE_THRESHOLD:
+                return False
+
+            cache.set(self._redis_key("circuit_open"), 1, ex=CIRCUIT_OPEN_SECONDS)
+            cache.delete(self._redis_key("circuit_probe"))
+        except Exception:
             return False
 
+        if failures == CIRCUIT_FAILURE_THRESHOLD:
+            # Logged once per outage; half-open probe failures re-open silently
+            frappe.log_error(
+                title="WhatsApp Circuit Open",
+                message=(
+                    f"{failures} consecutive transport failures — queue sending paused, "
+                    f"probing every {CIRCUIT_OPEN_SECONDS}s.\nLast error: {result.error}"
+                )
+            )
+        return True
+
+    @staticmethod
+    def is_outage(result):
+        """True when a post() result says Sparklebot itself is unreachable or failing"""
+        return bool(
+            not result.ok and not result.throttled
+            and (result.transport_error or (result.status_code or 0) >= 500)
+        )
+
+    def _redis_key(self, kind):
+        # Sparklebot quotas are per tenant, so the key is shared by every site
+        # sending through the same tenant slug.
+        return f"whatsapp:{kind}:{self.settings.tenant_slug or frappe.local.site}"
+
+    # ------------------------------------------------------------------
+    # Internal senders
+    # ------------------------------------------------------------------
+
+    def _send_text_message(self, phone, message, doctype, docname):
+        """POST to /messages/text"""
+        url, payload = self._text_request(phone, message)
+        return self.log_result(self.post(url, payload), phone, doctype, docname)
+
     def _send_template_message(self, phone, template_name, language,
                                field_params, doctype, docname,
                                header_document_url=None):
         """POST to /messages/template"""
+        url, payload = self._template_request(
+            phone, template_name, language, field_params,
+            header_document_url=header_document_url
+        )
+        return self.log_result(
+            self.post(url, payload), phone, doctype, docname, template_name=template_name
+        )
+
+    def _text_request(self, phone, message):
+        url = f"{self.base_url}/messages/text"
+        payload = {
+            "phone": phone,
+            "message": message
+        }
+        return url, payload
+
+    def _template_request(self, phone, template_name, language, field_params,
+                          header_document_url=None):
         url = f"{self.base_url}/messages/template"
         payload = {
             "phone_number": phone,
@@ -146,105 +501,253 @@ class SparklebotHandler:
         if header_document_url:
             payload["header_document_url"] = header_document_url
         payload.update(field_params)  # merges field_1, field_2, ...
+        return url, payload
 
-        try:
-            response = requests.post(url, json=payload, headers=self.headers, timeout=30)
-            return self._handle_response(response, phone, doctype, docname)
-        except Exception as e:
-            frappe.log_error(
-                title="WhatsApp Template Send Error",
-                message=f"DocType: {doctype} | Template: {template_name} | Phone: {phone}\n{str(e)}"
-            )
-            return False
+    def _require_phone(self, phone):
+        if not self.is_enabled():
+            frappe.throw("WhatsApp not configured")
+
+        clean_phone = self._build_phone(phone)
+        if not clean_phone:
+            frappe.throw(f"Invalid phone number: {phone}")
+        return clean_phone
+
+    @staticmethod
+    def _parse_response(response):
+        """Turn a Sparklebot HTTP response into a result dict (no side effects)"""
+        result = frappe._dict(ok=False, transport_error=False, throttled=False,
+                              status_code=response.status_code, wamid=None, error=None)
+
+        # 429, or any error carrying Retry-After (e.g. 503): not the message's
+        # fault — the queue backs off instead of spending a retry.
+        retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+        if response.status_code == 429 or (
+                response.status_code not in (200, 201) and retry_after is not None):
+            result.throttled = True
+            result.retry_after = retry_after
+            result.error = f"Throttled: status {response.status_code}"
+            return result
 
-    def _handle_response(self, response, phone, doctype, docname):
-        """Parse Sparklebot API response and return True on success"""
         if response.status_code not in (200, 201):
-            frappe.log_error(
-                title=f"WhatsApp HTTP Error - {doctype}",
-                message=f"Status {response.status_code} | Phone: {phone}\n{response.text[:1000]}"
-            )
-            return False
+            result.error = f"Status {response.status_code}\n{response.text[:1000]}"
+            return result
 
         try:
             data = response.json()
-            # Sparklebot success conditions:
-            #   text messages    → {"message_id": "...", "status": "sent"}
-            #   template messages → {"status": "success", "message": "template_sent_successfully", "data": {...}}
-            if data.get("status") in ("success", "sent") or data.get("message_id"):
-                # Extract wamid if available for traceability
-                try:
-                    wamid = (
-                        data.get("message_id")
-                        or data.get("data", {})
-                               .get("whatsapp_response", {})
-                               .get("messages", [{}])[0]
-                               .get("id", "N/A")
-                    )
-                except Exception:
-                    wamid = "N/A"
-                frappe.logger("whatsapp").info(
-                    f"WhatsApp sent | {doctype} | phone:{phone} | wamid:{wamid}"
-                )
-                return True
-            else:
-                frappe.log_error(
-                    title=f"WhatsApp API Error - {doctype}",
-                    message=f"Phone: {phone}\n{response.text[:1000]}"
-                )
-                return False
         except ValueError:
-            frappe.log_error(
-                title=f"WhatsApp API Error - {doctype}",
-                message=f"Non-JSON response | Phone: {phone}\n{response.text[:500]}"
-            )
-            return False
+            result.error = f"Non-JSON response\n{response.text[:500]}"
+            return result
+
+        # Sparklebot success conditions:
+        #   text messages    → {"message_id": "...", "status": "sent"}
+        #   template messages → {"status": "success", "message": "template_sent_successfully", "data": {...}}
+        if data.get("status") in ("success", "sent") or data.get("message_id"):
+            result.ok = True
+            # Extract wamid if available for traceability
+            try:
+                result.wamid = (
+                    data.get("message_id")
+                    or data.get("data", {})
+                           .get("whatsapp_response", {})
+                           .get("messages", [{}])[0]
+                           .get("id")
+                )
+            except Exception:
+                result.wamid = None
+        else:
+            result.error = response.text[:1000]
+        return result
 
     # ------------------------------------------------------------------
     # Phone number utilities
     # ------------------------------------------------------------------
 
     def _build_phone(self, phone):
-        """
-        Strip non-digits and prepend country code if not already present.
-        Uses WhatsApp Setting.default_country_code (default "91").
-        """
-        if not phone:
-            return None
+        """Full international number (see build_phone) using this handler's settings"""
+        return build_phone(phone, self.settings.default_country_code)
 
-        phone = re.sub(r'[^\d]', '', str(phone).strip())
-        if not phone:
-            return None
+    def _clean_phone_number(self, phone):
+        """Local number (see clean_phone_number) using this handler's settings"""
+        return clean_phone_number(phone, self.settings.default_country_code)
 
-        country_code = str(self.settings.default_country_code or "91").strip()
 
-        # If already prefixed with country code and total length is reasonable
-        if phone.startswith(country_code) and len(phone) > len(country_code):
-            return phone
+# ============================================================================
+# DELIVERY STATUS WEBHOOK
+# ============================================================================
 
-        return country_code + phone
+# Redis list of {"wamid", "status"} callbacks waiting to be applied
+STATUS_BUFFER_KEY = "whatsapp_status_buffer"
+# Callbacks applied per flush
+STATUS_FLUSH_SIZE = 5000
+# Held while a flush runs, so overlapping runs never trim each other's entries
+STATUS_FLUSH_LOCK_KEY = "whatsapp_status_buffer:lock"
+STATUS_FLUSH_LOCK_SECONDS = 300
+# A callback can beat send_batch() writing its wamid back — one that matches
+# no row is re-buffered and retried for this long before it is dropped
+STATUS_PENDING_SECONDS = 600
+# A status only ever moves forward (a late "delivered" never overwrites "read")
+DELIVERY_STATUS_RANK = ("sent", "delivered", "read", "failed")
+
+
+@frappe.whitelist(allow_guest=True, methods=["POST"])
+def sparklebot_status_webhook(token=None):
+    """
+    Sparklebot delivery-status callback. Only validates and buffers the
+    statuses in Redis so the request returns immediately; they are applied to
+    WhatsApp Queue rows in bulk by apply_delivery_statuses().
+    """
+    settings = safe_get_settings()
+    if not settings:
+        return {"status": "error", "message": "WhatsApp not configured"}
 
-    def _clean_phone_number(self, phone):
-        """
-        Returns just the local number (digits only, no country code).
-        Used internally by phone utility helpers.
-        """
-        if not phone:
-            return None
+    expected = get_decrypted_password(
+        "WhatsApp Setting", "WhatsApp Setting", "webhook_token", raise_exception=False
+    )
+    supplied = token or frappe.get_request_header("X-Webhook-Token") or ""
+    if not expected or not hmac.compare_digest(str(expected), str(supplied)):
+        frappe.local.response["http_status_code"] = 403
+        return {"status": "error", "message": "Invalid token"}
 
-        phone = re.sub(r'[^\d]', '', str(phone).strip())
-        if not phone:
-            return None
+    try:
+        data = json.loads(frappe.request.get_data(as_text=True) or "{}")
+    except ValueError:
+        frappe.local.response["http_status_code"] = 400
+        return {"status": "error", "message": "Invalid JSON"}
 
-        country_code = str(self.settings.default_country_code or "91").strip()
-        if phone.startswith(country_code) and len(phone) > len(country_code):
-            phone = phone[len(country_code):]
+    statuses = _extract_statuses(data)
+    buffer_delivery_statuses(statuses)
+    return {"status": "success", "received": len(statuses)}
 
-        # Minimum sanity check — at least 7 digits
-        if len(phone) >= 7:
-            return phone
 
-        return None
+def buffer_delivery_statuses(statuses):
+    """Append [{"wamid", "status"}] to the buffer apply_delivery_statuses() drains"""
+    if not statuses:
+        return
+    # Raw command on the site key — RedisWrapper.rpush takes a single value
+    # and prefixes the key itself
+    cache = frappe.cache()
+    pipe = cache.pipeline()
+    pipe.rpush(cache.make_key(STATUS_BUFFER_KEY), *(json.dumps(s) for s in statuses))
+    pipe.execute()
+
+
+def _extract_statuses(data):
+    """
+    Accepts Meta Cloud API style payloads (entry → changes → value → statuses),
+    a bare {"statuses": [...]}, a single {"id"/"wamid"/"message_id", "status"}
+    or a list of any of these. Returns [{"wamid", "status"}].
+    """
+    if isinstance(data, list):
+        return [s for item in data for s in _extract_statuses(item)]
+    if not isinstance(data, dict):
+        return []
+
+    if "entry" in data:
+        return [
+            s
+            for entry in data.get("entry") or []
+            for change in entry.get("changes") or []
+            for s in _extract_statuses(change.get("value") or {})
+        ]
+    if "statuses" in data:
+        return _extract_statuses(data.get("statuses") or [])
+
+    wamid = data.get("wamid") or data.get("message_id") or data.get("id")
+    status = str(data.get("status") or "").lower()
+    if wamid and status in DELIVERY_STATUS_RANK:
+        return [{"wamid": str(wamid), "status": status}]
+    return []
+
+
+def apply_delivery_statuses():
+    """
+    Scheduler (every minute): drain the webhook buffer and apply it with at
+    most one UPDATE per status value, keyed on wamid. Entries leave the buffer
+    only after the UPDATEs commit; those whose wamid is not on a row yet are
+    put back for up to STATUS_PENDING_SECONDS.
+    """
+    cache = frappe.cache()
+    lock_key = cache.make_key(STATUS_FLUSH_LOCK_KEY)
+    if not cache.set(lock_key, 1, nx=True, ex=STATUS_FLUSH_LOCK_SECONDS):
+        return  # another flush is running
+
+    try:
+        flushed = _apply_delivery_status_page(cache, cache.make_key(STATUS_BUFFER_KEY))
+    finally:
+        cache.delete(lock_key)
+
+    if flushed == STATUS_FLUSH_SIZE:
+        # More buffered than one flush handles — keep going in a fresh job
+        frappe.enqueue(
+            "techniti.whatsapp.whatsapp.apply_delivery_statuses",
+            queue="short",
+            job_id="whatsapp_apply_delivery_statuses",
+            deduplicate=True,
+        )
+
+
+def _apply_delivery_status_page(cache, key):
+    """
+    Apply the first STATUS_FLUSH_SIZE buffered callbacks; returns how many
+    were read. *key* is the site-prefixed key: every list command here is a
+    raw pipeline command, never the prefixing RedisWrapper helpers.
+    """
+    pipe = cache.pipeline()
+    pipe.lrange(key, 0, STATUS_FLUSH_SIZE - 1)
+    (raw,) = pipe.execute()
+    if not raw:
+        return 0
+
+    # Collapse to the furthest status seen per wamid, keeping when it was
+    # first buffered
+    latest = {}
+    first_seen = {}
+    received = _time.time()
+    for item in raw:
+        try:
+            entry = json.loads(item)
+        except ValueError:
+            continue
+        wamid = entry["wamid"]
+        first_seen[wamid] = min(first_seen.get(wamid, received), entry.get("at") or received)
+        current = latest.get(wamid)
+        if current is None or (
+                DELIVERY_STATUS_RANK.index(entry["status"]) > DELIVERY_STATUS_RANK.index(current)):
+            latest[wamid] = entry["status"]
+
+    known = set(frappe.get_all(
+        "WhatsApp Queue", filters={"wamid": ["in", list(latest)]}, pluck="wamid"
+    )) if latest else set()
+
+    by_status = {}
+    pending = []
+    for wamid, status in latest.items():
+        if wamid in known:
+            by_status.setdefault(status, []).append(wamid)
+        elif received - first_seen[wamid] < STATUS_PENDING_SECONDS:
+            pending.append(json.dumps({"wamid": wamid, "status": status, "at": first_seen[wamid]}))
+
+    now = now_datetime()
+    for status, wamids in by_status.items():
+        frappe.db.sql(
+            """
+            UPDATE `tabWhatsApp Queue`
+            SET delivery_status = %(status)s, delivery_updated_at = %(now)s
+            WHERE wamid IN %(wamids)s
+              AND FIELD(IFNULL(delivery_status, ''), 'sent', 'delivered', 'read', 'failed')
+                  < FIELD(%(status)s, 'sent', 'delivered', 'read', 'failed')
+            """,
+            {"status": status, "now": now, "wamids": tuple(wamids)},
+        )
+    frappe.db.commit()
+
+    # Only now drop what was applied (callbacks pushed meanwhile sit after it)
+    pipe = cache.pipeline()
+    pipe.ltrim(key, len(raw), -1)
+    if pending:
+        pipe.rpush(key, *pending)
+    pipe.execute()
+    return len(raw)
 
 
 # ============================================================================
@@ -318,6 +821,25 @@ class TemplateParameterBuilder:
 # MESSAGE TEMPLATE HANDLER (text messages)
 # ============================================================================
 
+# Compiled text templates kept per process, keyed on the template text
+TEMPLATE_CACHE_SIZE = 256
+
+# Placeholder groups; on a name clash the earlier group in
+# MessageTemplateHandler._resolve_placeholder wins
+_COMMON_FIELD_PLACEHOLDERS = (
+    'customer', 'supplier', 'posting_date', 'due_date',
+    'status', 'delivery_date', 'transaction_date',
+    'description', 'remarks', 'subject', 'title'
+)
+_HTML_FIELD_PLACEHOLDERS = ('description', 'remarks', 'subject', 'title')
+_TIME_PLACEHOLDERS = ('appointment_time', 'target_time', 'reminder_time', 'scheduled_time')
+_DATE_PLACEHOLDERS = ('due_date', 'target_date', 'reminder_date')
+_FORMATTED_DATE_PLACEHOLDERS = ('formatted_date', 'formatted_due_date')
+_DAYS_PLACEHOLDERS = ('days_remaining', 'days_left', 'day_text')
+_AMOUNT_PLACEHOLDERS = ('amount', 'total', 'grand_total')
+_NAME_PLACEHOLDERS = ('name', 'doc_name', 'document_name')
+
+
 class MessageTemplateHandler:
     """Handles text-mode message template processing and placeholder replacement"""
 
@@ -371,7 +893,7 @@ class MessageTemplateHandler:
         """Build WhatsApp text message using template or fallback default"""
         try:
             if notification.message:
-                template_doc = frappe.get_doc(
+                template_doc = frappe.get_cached_doc(
                     "WhatsApp Message Template", notification.message
                 )
                 if (template_doc
@@ -395,126 +917,117 @@ class MessageTemplateHandler:
             )
 
     @staticmethod
-    def _process_template(template_text, doc, target_date=None, target_time=None):
-        """Replace placeholders in template text"""
-        template_text = MessageTemplateHandler.clean_html(template_text)
-        placeholders = MessageTemplateHandler._build_placeholders(
-            doc, target_date, target_time
-        )
-        message = template_text
-
-        for placeholder, value in placeholders.items():
-            message = message.replace(placeholder, str(value))
-
-        # Handle any remaining {field_name} patterns dynamically
-        for pattern in re.findall(r'\{([^}]+)\}', message):
-            if hasattr(doc, pattern):
-                value = getattr(doc, pattern)
-                if value:
-                    if isinstance(value, str):
-                        value = MessageTemplateHandler.clean_html(value)
-                    if hasattr(value, 'strftime'):
-                        try:
-                            value = formatdate(value)
-                        except Exception:
-                            value = str(value)
-                    message = message.replace(f'{{{pattern}}}', str(value))
-                else:
-                    message = message.replace(f'{{{pattern}}}', "")
-
-        return MessageTemplateHandler.format_whatsapp_message(message)
+    @lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+    def compile_template(template_text):
+        """
+        Clean the template's HTML once and split it into segments: even
+        indexes are literal text, odd indexes are placeholder names. Cached
+        on the text itself, so an edited template compiles afresh.
+        """
+        cleaned = MessageTemplateHandler.clean_html(template_text) or ""
+        return tuple(re.split(r'\{([^}]+)\}', cleaned))
 
     @staticmethod
-    def _build_placeholders(doc, target_date=None, target_time=None):
-        """Build common replacement dictionary"""
-        placeholders = {
-            '{doctype}': doc.doctype,
-            '{name}': doc.name,
-            '{doc_name}': doc.name,
-            '{document_name}': doc.name,
-        }
+    def _process_template(template_text, doc, target_date=None, target_time=None):
+        """Render a compiled template, resolving only the placeholders it uses"""
+        segments = MessageTemplateHandler.compile_template(template_text)
+        resolved = {}
+        parts = []
+
+        for index, segment in enumerate(segments):
+            if index % 2 == 0:
+                parts.append(segment)
+                continue
+            if segment not in resolved:
+                resolved[segment] = MessageTemplateHandler._resolve_placeholder(
+                    segment, doc, target_date, target_time
+                )
+            parts.append(resolved[segment])
 
-        amount = getattr(doc, "grand_total", None) or getattr(doc, "total", None)
-        amount_str = f"₹{amount}" if amount else ""
-        placeholders.update({
-            '{amount}': amount_str,
-            '{total}': amount_str,
-            '{grand_total}': amount_str
-        })
+        return MessageTemplateHandler.format_whatsapp_message("".join(parts))
 
-        if target_date:
-            placeholders.update({
-                '{due_date}': str(target_date),
-                '{target_date}': str(target_date),
-                '{reminder_date}': str(target_date),
-                '{formatted_date}': formatdate(target_date) if target_date else "",
-                '{formatted_due_date}': formatdate(target_date) if target_date else ""
-            })
-            try:
-                days_diff = date_diff(target_date, nowdate())
-                placeholders.update({
-                    '{days_remaining}': str(max(0, days_diff)),
-                    '{days_left}': str(max(0, days_diff)),
-                    '{day_text}': "day" if days_diff == 1 else "days" if days_diff > 1 else "today"
-                })
-            except Exception:
-                placeholders.update({
-                    '{days_remaining}': "", '{days_left}': "", '{day_text}': ""
-                })
+    @staticmethod
+    def _resolve_placeholder(name, doc, target_date=None, target_time=None):
+        """
+        Value for one {name} placeholder. Precedence on clashes: common doc
+        fields > time > date > amount > doctype / name > any other doc field.
+        Unknown names are left in the message as written.
+        """
+        if name in _COMMON_FIELD_PLACEHOLDERS and hasattr(doc, name):
+            value = getattr(doc, name)
+            if not value:
+                return ""
+            if isinstance(value, str) and name in _HTML_FIELD_PLACEHOLDERS:
+                value = MessageTemplateHandler.clean_html(value)
+            elif hasattr(value, 'strftime'):
+                try:
+                    value = formatdate(value)
+                except Exception:
+                    value = str(value)
+            return str(value)
 
-        if target_time:
+        if name in _TIME_PLACEHOLDERS and target_time:
             try:
-                if isinstance(target_time, str):
-                    time_str = target_time
-                elif isinstance(target_time, timedelta):
-                    total_seconds = int(target_time.total_seconds())
-                    hours = total_seconds // 3600
-                    minutes = (total_seconds % 3600) // 60
-                    time_str = f"{hours:02d}:{minutes:02d}"
-                elif hasattr(target_time, 'strftime'):
-                    time_str = target_time.strftime("%H:%M")
-                else:
-                    time_str = str(target_time)
-
-                placeholders.update({
-                    '{appointment_time}': time_str,
-                    '{target_time}': time_str,
-                    '{reminder_time}': time_str,
-                    '{scheduled_time}': time_str
-                })
+                return MessageTemplateHandler._format_time(target_time)
             except Exception as e:
                 frappe.log_error(
                     f"Error processing time placeholders: {str(e)}",
                     "WhatsApp Time Placeholder Error"
                 )
-                placeholders.update({
-                    '{appointment_time}': "", '{target_time}': "",
-                    '{reminder_time}': "", '{scheduled_time}': ""
-                })
+                return ""
 
-        common_fields = [
-            'customer', 'supplier', 'posting_date', 'due_date',
-            'status', 'delivery_date', 'transaction_date',
-            'description', 'remarks', 'subject', 'title'
-        ]
-        for field in common_fields:
-            if hasattr(doc, field):
-                value = getattr(doc, field)
-                if value:
-                    if isinstance(value, str) and field in [
-                        'description', 'remarks', 'subject', 'title'
-                    ]:
-                        value = MessageTemplateHandler.clean_html(value)
-                    elif hasattr(value, 'strftime'):
-                        try:
-                            value = formatdate(value)
-                        except Exception:
-                            value = str(value)
-                    placeholders[f'{{{field}}}'] = str(value)
-                else:
-                    placeholders[f'{{{field}}}'] = ""
+        if target_date:
+            if name in _DATE_PLACEHOLDERS:
+                return str(target_date)
+            if name in _FORMATTED_DATE_PLACEHOLDERS:
+                return formatdate(target_date)
+            if name in _DAYS_PLACEHOLDERS:
+                try:
+                    days_diff = date_diff(target_date, nowdate())
+                except Exception:
+                    return ""
+                if name == 'day_text':
+                    return "day" if days_diff == 1 else "days" if days_diff > 1 else "today"
+                return str(max(0, days_diff))
+
+        if name in _AMOUNT_PLACEHOLDERS:
+            amount = getattr(doc, "grand_total", None) or getattr(doc, "total", None)
+            return f"₹{amount}" if amount else ""
+
+        if name == 'doctype':
+            return doc.doctype
+        if name in _NAME_PLACEHOLDERS:
+            return doc.name
+
+        # Any other {field_name} on the document
+        if hasattr(doc, name):
+            value = getattr(doc, name)
+            if not value:
+                return ""
+            if isinstance(value, str):
+                value = MessageTemplateHandler.clean_html(value)
+            if hasattr(value, 'strftime'):
+                try:
+                    value = formatdate(value)
+                except Exception:
+                    value = str(value)
+            return str(value)
+
+        return f"{{{name}}}"
 
-        return placeholders
+    @staticmethod
+    def _format_time(target_time):
+        """HH:MM for a time string, timedelta (Time fields) or time/datetime"""
+        if isinstance(target_time, str):
+            return target_time
+        if isinstance(target_time, timedelta):
+            total_seconds = int(target_time.total_seconds())
+            hours = total_seconds // 3600
+            minutes = (total_seconds % 3600) // 60
+            return f"{hours:02d}:{minutes:02d}"
+        if hasattr(target_time, 'strftime'):
+            return target_time.strftime("%H:%M")
+        return str(target_time)
 
     @staticmethod
     def _build_default_message(doc, notification, target_date=None, target_time=None):
@@ -522,17 +1035,7 @@ class MessageTemplateHandler:
         if notification.event == "Scheduled Reminder":
             if target_date and target_time:
                 try:
-                    if isinstance(target_time, str):
-                        time_str = target_time
-                    elif isinstance(target_time, timedelta):
-                        total_seconds = int(target_time.total_seconds())
-                        hours = total_seconds // 3600
-                        minutes = (total_seconds % 3600) // 60
-                        time_str = f"{hours:02d}:{minutes:02d}"
-                    elif hasattr(target_time, 'strftime'):
-                        time_str = target_time.strftime("%H:%M")
-                    else:
-                        time_str = str(target_time)
+                    time_str = MessageTemplateHandler._format_time(target_time)
                     message = (
                         f"Reminder: Your {doc.doctype} *{doc.name}* is scheduled "
                         f"for {formatdate(target_date)} at {time_str}."
@@ -596,8 +1099,56 @@ class MessageTemplateHandler:
 # NOTIFICATION QUERY HELPERS
 # ============================================================================
 
+# Redis copy of the registry and the version stamp workers compare against
+REGISTRY_CACHE_KEY = "whatsapp_notification_registry"
+REGISTRY_VERSION_KEY = "whatsapp_notification_registry_version"
+
+# Per-site, in-process copies: {site: (version, registry)} and {site: pdf doctypes}
+_registries = {}
+_pdf_doctypes = {}
+
+
+def get_notification_registry():
+    """
+    {(document_type, event): [notification names]} for every enabled
+    WhatsApp Notification.
+
+    Held in worker memory and checked against a version stamp in Redis (one
+    cached GET per request); a stale copy is reloaded from the Redis copy,
+    which is rebuilt from the DB only after clear_notification_cache().
+    """
+    cache = frappe.cache()
+    version = cache.get_value(REGISTRY_VERSION_KEY)
+    if not version:
+        version = frappe.generate_hash(length=10)
+        cache.set_value(REGISTRY_VERSION_KEY, version)
+
+    cached = _registries.get(frappe.local.site)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    registry = cache.get_value(REGISTRY_CACHE_KEY, generator=_build_notification_registry)
+    _registries[frappe.local.site] = (version, registry)
+    return registry
+
+
+def _build_notification_registry():
+    registry = {}
+    for row in frappe.get_all(
+        "WhatsApp Notification",
+        filters={"enabled": 1},
+        fields=["name", "document_type", "event"],
+    ):
+        registry.setdefault((row.document_type, row.event), []).append(row.name)
+    return registry
+
+
 def get_active_notifications(document_type=None, event=None):
     """Get enabled WhatsApp Notification records with optional filters"""
+    if document_type and event:
+        names = get_notification_registry().get((document_type, event)) or []
+        return [frappe._dict(name=name) for name in names]
+
     filters = {"enabled": 1}
     if document_type:
         filters["document_type"] = document_type
@@ -606,10 +1157,109 @@ def get_active_notifications(document_type=None, event=None):
     return frappe.get_all("WhatsApp Notification", filters=filters, fields=["name"])
 
 
+# Redis hash: WhatsApp Notification name → header_document_field of its template
+HEADER_FIELD_CACHE_KEY = "whatsapp_header_document_field"
+
+
+def get_header_document_field(notification):
+    """
+    Source-document field holding the header PDF URL for *notification*
+    ("" when its template has none). Cached until a WhatsApp Notification or
+    WhatsApp Message Template is saved.
+    """
+    if not notification:
+        return ""
+
+    def resolve():
+        template = frappe.db.get_value("WhatsApp Notification", notification, "message")
+        if not template:
+            return ""
+        return frappe.db.get_value(
+            "WhatsApp Message Template", template, "header_document_field"
+        ) or ""
+
+    return frappe.cache().hget(HEADER_FIELD_CACHE_KEY, notification, generator=resolve)
+
+
+def clear_notification_cache(doc=None, method=None):
+    """
+    Drop every cache derived from WhatsApp Notification / Message Template
+    config. Runs again after commit so no worker can rebuild from the
+    pre-save rows in between.
+    """
+    _clear_notification_cache()
+    frappe.db.after_commit.add(_clear_notification_cache)
+
+
+def _clear_notification_cache():
+    cache = frappe.cache()
+    cache.delete_key(HEADER_FIELD_CACHE_KEY)
+    cache.delete_value(REGISTRY_CACHE_KEY)
+    cache.set_value(REGISTRY_VERSION_KEY, frappe.generate_hash(length=10))
+
+
 # ============================================================================
 # PHONE NUMBER UTILITIES
 # ============================================================================
 
+def build_phone(phone, country_code=None):
+    """
+    Strip non-digits and prepend country code if not already present.
+    Uses WhatsApp Setting.default_country_code (default "91") unless given.
+    """
+    if not phone:
+        return None
+
+    phone = re.sub(r'[^\d]', '', str(phone).strip())
+    if not phone:
+        return None
+
+    country_code = _country_code(country_code)
+
+    # If already prefixed with country code and total length is reasonable
+    if phone.startswith(country_code) and len(phone) > len(country_code):
+        return phone
+
+    return country_code + phone
+
+
+def clean_phone_number(phone, country_code=None):
+    """
+    Returns just the local number (digits only, no country code).
+    Used internally by phone utility helpers.
+    """
+    if not phone:
+        return None
+
+    phone = re.sub(r'[^\d]', '', str(phone).strip())
+    if not phone:
+        return None
+
+    country_code = _country_code(country_code)
+    if phone.startswith(country_code) and len(phone) > len(country_code):
+        phone = phone[len(country_code):]
+
+    # Minimum sanity check — at least 7 digits
+    if len(phone) >= 7:
+        return phone
+
+    return None
+
+
+def _country_code(country_code=None):
+    if not country_code:
+        settings = safe_get_settings()
+        country_code = settings and settings.default_country_code
+    return str(country_code or "91").strip()
+
+
+# User columns searched for a phone, first non-empty wins
+USER_PHONE_FIELDS = ("mobile_no", "phone", "cell_number", "whatsapp_number")
+# Enabled members of a role (raw phone columns), cleared when a User is saved or deleted
+ROLE_PHONES_CACHE_KEY = "whatsapp_role_phones"
+ROLE_PHONES_CACHE_TTL = 300
+
+
 def get_phone_number(doc, phone_field):
     """Get phone number from document, supporting linked field notation (field.subfield)"""
     if not phone_field:
@@ -619,7 +1269,7 @@ def get_phone_number(doc, phone_field):
 
     if len(parts) == 1:
         phone = getattr(doc, parts[0], None)
-        return SparklebotHandler()._clean_phone_number(phone)
+        return clean_phone_number(phone)
 
     if len(parts) == 2:
         try:
@@ -634,7 +1284,7 @@ def get_phone_number(doc, phone_field):
 
             linked_doc = frappe.get_doc(link_field.options, link_docname)
             phone = getattr(linked_doc, target_fieldname, None)
-            return SparklebotHandler()._clean_phone_number(phone)
+            return clean_phone_number(phone)
         except Exception as e:
             frappe.log_error(
                 f"Error getting phone number: {str(e)}",
@@ -683,14 +1333,14 @@ def get_user_phone_number(doc, user_field):
         if not username:
             return None
 
-        user_doc = frappe.get_doc("User", username)
-        for field in ['mobile_no', 'phone', 'cell_number', 'whatsapp_number']:
-            if hasattr(user_doc, field):
-                phone = getattr(user_doc, field)
-                if phone:
-                    cleaned = SparklebotHandler()._clean_phone_number(phone)
-                    if cleaned:
-                        return cleaned
+        # Reminder pages prefetch every user they reference in one query
+        prefetched = frappe.flags.whatsapp_user_phones
+        if prefetched is not None and username in prefetched:
+            phone = prefetched[username]
+        else:
+            phone = _user_phones([username]).get(username)
+        if phone:
+            return phone
 
         frappe.log_error(
             f"No phone number found for user {username}",
@@ -708,55 +1358,12 @@ def get_user_phone_number(doc, user_field):
 def get_assigned_user_phone_numbers(doc):
     """Get phone numbers for all open ToDo assignees of a document"""
     try:
-        todos = frappe.get_all(
-            "ToDo",
-            filters={
-                "reference_type": doc.doctype,
-                "reference_name": doc.name,
-                "status": "Open"
-            },
-            fields=["allocated_to"]
-        )
-
-        if not todos:
-            todos = frappe.get_all(
-                "ToDo",
-                filters={"reference_type": doc.doctype, "reference_name": doc.name},
-                fields=["allocated_to"]
-            )
-
-        if not todos:
-            return []
+        # Reminder pages prefetch the assignees of every document they hold
+        prefetched = frappe.flags.whatsapp_assignee_phones
+        if prefetched is not None and (doc.doctype, doc.name) in prefetched:
+            return prefetched[(doc.doctype, doc.name)]
 
-        phone_numbers = []
-        processed_users = set()
-
-        for todo in todos:
-            if not todo.allocated_to or todo.allocated_to in processed_users:
-                continue
-            processed_users.add(todo.allocated_to)
-
-            try:
-                user_doc = frappe.get_doc("User", todo.allocated_to)
-                user_phone = None
-                for field in ['mobile_no', 'phone', 'cell_number', 'whatsapp_number']:
-                    if hasattr(user_doc, field):
-                        phone = getattr(user_doc, field)
-                        if phone:
-                            cleaned = SparklebotHandler()._clean_phone_number(phone)
-                            if cleaned:
-                                user_phone = cleaned
-                                break
-
-                if user_phone:
-                    phone_numbers.append({'phone': user_phone, 'user': todo.allocated_to})
-            except Exception as user_error:
-                frappe.log_error(
-                    f"Error processing user {todo.allocated_to}: {str(user_error)}",
-                    f"Assignment User Error - {doc.doctype}"
-                )
-
-        return phone_numbers
+        return _assigned_phones(doc.doctype, [doc.name]).get(doc.name, [])
     except Exception as e:
         frappe.log_error(
             f"Error getting assigned users' phones: {str(e)}",
@@ -768,47 +1375,30 @@ def get_assigned_user_phone_numbers(doc):
 def get_phone_numbers_by_role(role):
     """Get phone numbers for all enabled users with a specific role"""
     try:
-        users = frappe.get_all(
-            "Has Role",
-            filters={"role": role, "parenttype": "User"},
-            fields=["parent"]
-        )
-        if not users:
+        columns = _user_phone_columns()
+        if not columns:
             return []
 
-        phone_numbers = []
-        processed_users = set()
-
-        for user_data in users:
-            username = user_data.parent
-            if username in processed_users:
-                continue
-            processed_users.add(username)
-
-            try:
-                user_doc = frappe.get_doc("User", username)
-                if user_doc.enabled == 0:
-                    continue
-
-                user_phone = None
-                for field in ['mobile_no', 'phone', 'cell_number', 'whatsapp_number']:
-                    if hasattr(user_doc, field):
-                        phone = getattr(user_doc, field)
-                        if phone:
-                            cleaned = SparklebotHandler()._clean_phone_number(phone)
-                            if cleaned:
-                                user_phone = cleaned
-                                break
-
-                if user_phone:
-                    phone_numbers.append({'phone': user_phone, 'user': username})
-            except Exception as user_error:
-                frappe.log_error(
-                    f"Error processing user {username}: {str(user_error)}",
-                    f"Role User Error - {role}"
-                )
+        key = f"{ROLE_PHONES_CACHE_KEY}:{role}"
+        users = frappe.cache().get_value(key)
+        if users is None:
+            users = frappe.db.sql(
+                f"""
+                SELECT usr.name AS user,
+                    {", ".join(f"usr.`{field}`" for field in columns)}
+                FROM `tabHas Role` has_role
+                JOIN `tabUser` usr ON usr.name = has_role.parent
+                WHERE has_role.role = %(role)s
+                    AND has_role.parenttype = 'User'
+                    AND usr.enabled = 1
+                ORDER BY has_role.modified DESC
+                """,
+                {"role": role},
+                as_dict=True,
+            )
+            frappe.cache().set_value(key, users, expires_in_sec=ROLE_PHONES_CACHE_TTL)
 
-        return phone_numbers
+        return _user_phone_rows(users, columns)
     except Exception as e:
         frappe.log_error(
             f"Error getting users by role {role}: {str(e)}",
@@ -817,6 +1407,100 @@ def get_phone_numbers_by_role(role):
         return []
 
 
+def clear_role_phone_cache(doc, method=None):
+    """User doc_event: drop cached role members for every role the user had or has"""
+    roles = set()
+    for user in (doc, doc.get_doc_before_save()):
+        if user:
+            roles.update(row.role for row in (user.get("roles") or []))
+
+    for role in roles:
+        if role:
+            frappe.cache().delete_value(f"{ROLE_PHONES_CACHE_KEY}:{role}")
+
+
+def _assigned_phones(doctype, names):
+    """
+    {name: [{'phone', 'user'}]} for the ToDo assignees of many documents in
+    one query; per document, open assignments win, otherwise any assignment.
+    """
+    columns = _user_phone_columns()
+    if not columns or not names:
+        return {}
+
+    todos = frappe.db.sql(
+        f"""
+        SELECT todo.reference_name, todo.allocated_to AS user, todo.status,
+            {", ".join(f"usr.`{field}`" for field in columns)}
+        FROM `tabToDo` todo
+        JOIN `tabUser` usr ON usr.name = todo.allocated_to
+        WHERE todo.reference_type = %(doctype)s
+            AND todo.reference_name IN %(names)s
+            AND usr.enabled = 1
+        ORDER BY todo.modified DESC
+        """,
+        {"doctype": doctype, "names": tuple(names)},
+        as_dict=True,
+    )
+
+    by_name = {}
+    for todo in todos:
+        by_name.setdefault(todo.reference_name, []).append(todo)
+
+    return {
+        name: _user_phone_rows(
+            [todo for todo in rows if todo.status == "Open"] or rows, columns
+        )
+        for name, rows in by_name.items()
+    }
+
+
+def _user_phones(usernames):
+    """{username: phone or None} for many users, one query"""
+    columns = _user_phone_columns()
+    if not columns or not usernames:
+        return {}
+
+    users = frappe.get_all(
+        "User",
+        filters={"name": ["in", list(usernames)]},
+        fields=["name", *columns],
+    )
+    return {user.name: _first_user_phone(user, columns) for user in users}
+
+
+def _user_phone_columns():
+    """Phone columns present on User, in lookup order"""
+    meta = frappe.get_meta("User")
+    return [field for field in USER_PHONE_FIELDS if meta.has_field(field)]
+
+
+def _first_user_phone(user, columns):
+    """First phone column that cleans to a usable number"""
+    for field in columns:
+        cleaned = clean_phone_number(user.get(field))
+        if cleaned:
+            return cleaned
+    return None
+
+
+def _user_phone_rows(users, columns):
+    """[{'phone', 'user'}] for distinct users that have a usable phone"""
+    phone_numbers = []
+    processed_users = set()
+
+    for user in users:
+        if user.user in processed_users:
+            continue
+        processed_users.add(user.user)
+
+        phone = _first_user_phone(user, columns)
+        if phone:
+            phone_numbers.append({'phone': phone, 'user': user.user})
+
+    return phone_numbers
+
+
 # ============================================================================
 # LINKED DOCUMENT PROCESSING
 # ============================================================================
@@ -1006,38 +1690,84 @@ def _deduplicate(phone_list):
 # CONDITION EVALUATION
 # ============================================================================
 
+CONDITION_CACHE_SIZE = 512
+
+# Document attributes that are not fields and never reach a condition
+_CONDITION_HIDDEN_ATTRS = frozenset(["flags", "meta", "dont_update_if_missing"])
+
+
+class _ConditionContext(dict):
+    """
+    Evaluation globals for a condition. Helpers and ``doc`` are set up front;
+    a bare field name is read from the document only when the condition
+    actually references it, instead of copying every column (and child
+    table) into the dict first.
+    """
+
+    def __init__(self, base, doc):
+        super().__init__(base)
+        self["doc"] = doc
+        self._doc = doc
+
+    def __missing__(self, key):
+        if (key.startswith("_") or key in _CONDITION_HIDDEN_ATTRS
+                or key not in self._doc.__dict__):
+            raise KeyError(key)
+        value = self[key] = self._doc.get(key)
+        return value
+
+
+_CONDITION_HELPERS = {
+    'frappe': frappe,
+    'nowdate': frappe.utils.nowdate,
+    'now_datetime': frappe.utils.now_datetime,
+    'add_days': frappe.utils.add_days,
+    'date_diff': frappe.utils.date_diff,
+    'cint': frappe.utils.cint,
+    'cstr': frappe.utils.cstr,
+    'flt': frappe.utils.flt
+}
+
+
+@lru_cache(maxsize=1)
+def _condition_globals():
+    from frappe.utils.safe_exec import WHITELISTED_SAFE_EVAL_GLOBALS
+
+    return {"__builtins__": {}, **WHITELISTED_SAFE_EVAL_GLOBALS, **_CONDITION_HELPERS}
+
+
+@lru_cache(maxsize=CONDITION_CACHE_SIZE)
+def _compile_condition(condition_code):
+    """
+    Validate and compile a condition exactly as frappe.safe_eval does (same
+    RestrictedPython policy), once per condition text. Invalid conditions
+    raise and are not cached.
+    """
+    from frappe.utils.safe_exec import FrappeTransformer, _validate_safe_eval_syntax
+    from RestrictedPython import compile_restricted_eval
+
+    code = unicodedata.normalize("NFKC", condition_code)
+    _validate_safe_eval_syntax(code)
+    result = compile_restricted_eval(code, filename="<safe_eval>", policy=FrappeTransformer)
+    if result.code is None:
+        raise SyntaxError("; ".join(result.errors))
+    return result.code
+
+
 def evaluate_custom_condition(doc, condition_code):
     """Safely evaluate a Python condition string against a document"""
     if not condition_code or not condition_code.strip():
         return True
 
     try:
-        context = {
-            'doc': doc,
-            'frappe': frappe,
-            'nowdate': frappe.utils.nowdate,
-            'now_datetime': frappe.utils.now_datetime,
-            'add_days': frappe.utils.add_days,
-            'date_diff': frappe.utils.date_diff,
-            'cint': frappe.utils.cint,
-            'cstr': frappe.utils.cstr,
-            'flt': frappe.utils.flt
-        }
-
-        try:
-            for fieldname in doc.meta.get_valid_columns():
-                if hasattr(doc, fieldname):
-                    context[fieldname] = doc.get(fieldname)
-        except Exception:
-            pass
-
         try:
-            for key in doc.as_dict():
-                context[key] = doc.get(key)
-        except Exception:
-            pass
+            code = _compile_condition(condition_code)
+            context = _ConditionContext(_condition_globals(), doc)
+        except ImportError:
+            # safe_exec internals moved — evaluate uncached through the public API
+            return bool(frappe.safe_eval(condition_code, _ConditionContext(_CONDITION_HELPERS, doc)))
 
-        return bool(frappe.safe_eval(condition_code, context))
+        return bool(eval(code, context))
     except Exception as e:
         frappe.log_error(
             f"Error evaluating condition: {str(e)}\n"
@@ -1051,24 +1781,44 @@ def evaluate_custom_condition(doc, condition_code):
 # CORE NOTIFICATION PROCESSOR
 # ============================================================================
 
-def _dispatch_message(handler, recipient, doc, notification,
-                      target_date=None, target_time=None, trigger_event=None):
+# An identical message to the same phone inside this window is a double-send
+DEDUP_WINDOW_MINUTES = 10
+# Redis keys marking committed rows for that window, one per (doc,
+# notification, phone, event)
+DEDUP_CACHE_KEY = "whatsapp_queue_dedup"
+# Columns of a dedup key, in key order
+_DEDUP_KEY_FIELDS = ("reference_doctype", "reference_name", "notification", "phone", "trigger_event")
+
+_QUEUE_INSERT_FIELDS = (
+    "name", "creation", "modified", "owner", "modified_by", "docstatus",
+    "status", "phone", "message_type", "template_name", "template_language",
+    "field_params", "header_document_url", "message",
+    "reference_doctype", "reference_name", "notification", "trigger_event",
+    "priority", "priority_rank", "retry",
+)
+
+
+def _build_render_plan(doc, notification, target_date=None, target_time=None,
+                       trigger_event=None):
     """
-    Create a WhatsApp Queue entry for one recipient.
-    Actual sending is handled by the queue processor scheduler.
-    Returns True always (queue creation = success; failures log themselves).
+    Queue-row fields shared by every recipient of one (document, notification):
+    the template parameters and header URL, or the rendered text message.
+    Built once and reused for each recipient.
     """
-    import json as _json
-
-    phone = recipient['phone']
-
     template_doc = None
     if notification.message:
         try:
-            template_doc = frappe.get_doc("WhatsApp Message Template", notification.message)
+            template_doc = frappe.get_cached_doc("WhatsApp Message Template", notification.message)
         except Exception:
             pass
 
+    reference = {
+        "reference_doctype": doc.doctype,
+        "reference_name": doc.name,
+        "notification": notification.name,
+        "trigger_event": trigger_event or notification.event,
+    }
+
     # Template mode
     if (template_doc
             and template_doc.is_active
@@ -1078,19 +1828,14 @@ def _dispatch_message(handler, recipient, doc, notification,
         header_url = None
         if template_doc.header_document_field:
             header_url = doc.get(template_doc.header_document_field) or None
-        _create_queue_entry(
-            phone=phone,
-            message_type="template",
-            template_name=template_doc.wa_template_name,
-            template_language=template_doc.template_language or "en",
-            field_params=_json.dumps(field_params),
-            header_document_url=header_url,
-            reference_doctype=doc.doctype,
-            reference_name=doc.name,
-            notification=notification.name,
-            trigger_event=trigger_event or notification.event,
-        )
-        return True
+        return {
+            "message_type": "template",
+            "template_name": template_doc.wa_template_name,
+            "template_language": template_doc.template_language or "en",
+            "field_params": json.dumps(field_params),
+            "header_document_url": header_url,
+            **reference,
+        }
 
     # Text mode (default)
     message = MessageTemplateHandler.build_message(
@@ -1099,62 +1844,155 @@ def _dispatch_message(handler, recipient, doc, notification,
         target_date=target_date,
         target_time=target_time
     )
-    _create_queue_entry(
-        phone=phone,
-        message_type="text",
-        message=message,
-        reference_doctype=doc.doctype,
-        reference_name=doc.name,
-        notification=notification.name,
-        trigger_event=trigger_event or notification.event,
-    )
-    return True
+    return {"message_type": "text", "message": message, **reference}
+
+
+def _queue_rows(plan, recipients):
+    """One queue row per recipient, sharing the rendered *plan*"""
+    return [{"phone": recipient['phone'], **plan} for recipient in recipients]
+
+
+def _bulk_insert_queue_rows(rows):
+    """
+    Insert WhatsApp Queue rows with one multi-row INSERT and one commit.
+    Deduplicates: skips a row if an identical (notification, doc, phone,
+    trigger_event) entry was queued within the last 10 minutes, or appears
+    earlier in *rows* — prevents double-sends when multiple doc events fire
+    on submit. Keys marked in Redis are skipped outright; the rest are
+    checked against live rows in the DB before the insert. The Redis marks
+    are only written once the insert commits, so a job killed before its
+    commit leaves nothing behind that would make a retry skip its rows.
+    Returns the number of rows inserted.
+    """
+    from techniti.techniti.doctype.whatsapp_queue.whatsapp_queue import notify_dispatcher
+
+    if not rows:
+        return 0
+
+    keys = [_queue_dedup_key(row) for row in rows]
+    marked = _marked_dedup_keys(keys)
+    candidates = [(row, key) for row, key in zip(rows, keys, strict=True) if key not in marked]
+    seen = _recent_queue_keys([key for _row, key in candidates]) if candidates else set()
+    fresh = []
+    for row, key in candidates:
+        if key not in seen:
+            seen.add(key)
+            fresh.append((row, key))
+
+    now = now_datetime()
+    user = frappe.session.user
+    values = []
+
+    for row, key in fresh:
+        values.append((
+            frappe.generate_hash(length=10), now, now, user, user, 0,
+            "Not Sent",
+            row["phone"],
+            row["message_type"],
+            row.get("template_name"),
+            row.get("template_language") or "en",
+            row.get("field_params"),
+            row.get("header_document_url"),
+            row.get("message"),
+            *key[:3],
+            key[4],
+            1,
+            -1,
+            0,
+        ))
+
+    if not values:
+        return 0
+
+    frappe.db.bulk_insert("WhatsApp Queue", _QUEUE_INSERT_FIELDS, values)
+    frappe.db.after_commit.add(partial(_mark_dedup_keys, [key for _row, key in fresh]))
+    notify_dispatcher()
+    frappe.db.commit()
+    return len(values)
+
+
+def _flush_queue_rows(rows, error_title):
+    """Bulk-insert and empty *rows*; returns (queued, failed) recipient counts"""
+    count = len(rows)
+    if not count:
+        return 0, 0
+
+    try:
+        _bulk_insert_queue_rows(rows)
+        return count, 0
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error(f"Queueing {count} message(s) failed: {str(e)}", error_title)
+        return 0, count
+    finally:
+        rows.clear()
 
 
-def _create_queue_entry(phone, message_type, reference_doctype, reference_name,
-                        notification, trigger_event,
-                        template_name=None, template_language="en",
-                        field_params=None, header_document_url=None, message=None):
+def _queue_dedup_key(row):
+    return tuple(row[field] for field in _DEDUP_KEY_FIELDS)
+
+
+def _dedup_redis_keys(cache, keys):
+    return [
+        cache.make_key(
+            f"{DEDUP_CACHE_KEY}:"
+            + hashlib.sha1("\x1f".join(str(part or "") for part in key).encode()).hexdigest()
+        )
+        for key in keys
+    ]
+
+
+def _marked_dedup_keys(keys):
     """
-    Insert a WhatsApp Queue record.
-    Deduplicates: skips if an identical (notification, doc, phone, trigger_event)
-    entry already exists with status Not Sent, Sending, or Sent within the last
-    10 minutes — prevents double-sends when multiple doc events fire on submit.
+    The dedup keys among *keys* marked in Redis by a committed insert, in one
+    pipeline round trip. Empty when Redis is unavailable (the DB check
+    still applies).
     """
-    ten_min_ago = frappe.utils.add_to_date(frappe.utils.now_datetime(), minutes=-10)
-    duplicate = frappe.db.exists(
+    try:
+        cache = frappe.cache()
+        pipe = cache.pipeline()
+        for redis_key in _dedup_redis_keys(cache, keys):
+            pipe.exists(redis_key)
+        found = pipe.execute()
+    except Exception:
+        return set()
+
+    return {key for key, exists in zip(keys, found, strict=True) if exists}
+
+
+def _mark_dedup_keys(keys):
+    """after_commit: mark the committed rows' dedup keys for DEDUP_WINDOW_MINUTES"""
+    try:
+        cache = frappe.cache()
+        pipe = cache.pipeline()
+        for redis_key in _dedup_redis_keys(cache, keys):
+            pipe.set(redis_key, 1, ex=DEDUP_WINDOW_MINUTES * 60)
+        pipe.execute()
+    except Exception:
+        pass  # the DB check still catches repeats inside the window
+
+
+def _recent_queue_keys(keys):
+    """Dedup keys of live rows created inside the window — one query for the whole set"""
+    existing = frappe.get_all(
         "WhatsApp Queue",
-        {
-            "reference_doctype": reference_doctype,
-            "reference_name": reference_name,
-            "notification": notification,
-            "phone": phone,
-            "trigger_event": trigger_event,
-            "status": ["in", ["Not Sent", "Sending", "Sent"]],
-            "creation": [">", ten_min_ago],
-        },
+        filters=_recent_queue_filters(keys),
+        fields=list(_DEDUP_KEY_FIELDS),
     )
-    if duplicate:
-        return
+    return {_queue_dedup_key(row) for row in existing}
 
-    frappe.get_doc({
-        "doctype": "WhatsApp Queue",
-        "status": "Not Sent",
-        "phone": phone,
-        "message_type": message_type,
-        "template_name": template_name,
-        "template_language": template_language,
-        "field_params": field_params,
-        "header_document_url": header_document_url,
-        "message": message,
-        "reference_doctype": reference_doctype,
-        "reference_name": reference_name,
-        "notification": notification,
-        "trigger_event": trigger_event,
-        "priority": 1,
-        "retry": 0,
-    }).insert(ignore_permissions=True)
-    frappe.db.commit()
+
+def _recent_queue_filters(keys):
+    """Filters of the _recent_queue_keys lookup (served by the WhatsApp Queue dedup_index)"""
+    since = add_to_date(now_datetime(), minutes=-DEDUP_WINDOW_MINUTES)
+    return {
+        **{
+            field: ["in", list({key[i] for key in keys})]
+            for i, field in enumerate(_DEDUP_KEY_FIELDS)
+        },
+        "status": ["in", ["Not Sent", "Sending", "Sent"]],
+        "creation": [">", since],
+    }
 
 
 def _process_whatsapp_notification(doc, notification, handler,
@@ -1173,16 +2011,23 @@ def _process_whatsapp_notification(doc, notification, handler,
         )
         return False
 
-    for recipient in recipients:
-        try:
-            _dispatch_message(handler, recipient, doc, notification,
-                               target_date, target_time,
-                               trigger_event=trigger_event)
-        except Exception as e:
-            frappe.log_error(
-                title=f"WhatsApp Dispatch Error - {doc.doctype}",
-                message=f"Notification: {notification.name}\nRecipient: {recipient['source']}\n{str(e)}"
-            )
+    try:
+        plan = _build_render_plan(doc, notification, target_date, target_time,
+                                  trigger_event=trigger_event)
+    except Exception as e:
+        frappe.log_error(
+            title=f"WhatsApp Render Error - {doc.doctype}",
+            message=f"Notification: {notification.name} | Document: {doc.name}\n{str(e)}"
+        )
+        return False
+
+    try:
+        _bulk_insert_queue_rows(_queue_rows(plan, recipients))
+    except Exception as e:
+        frappe.log_error(
+            title=f"WhatsApp Dispatch Error - {doc.doctype}",
+            message=f"Notification: {notification.name}\nRecipients: {len(recipients)}\n{str(e)}"
+        )
 
     frappe.logger("whatsapp").info(
         f"WhatsApp queued | {notification.name} | {doc.doctype} {doc.name} "
@@ -1209,37 +2054,42 @@ _EXCLUDED_DOCTYPES = frozenset([
 
 def _doctype_has_pdf_config(doctype):
     """Return True if doctype is in attach_pdf_config (WhatsApp is chained from the PDF job)."""
-    for hook_dict in (frappe.get_hooks("attach_pdf_config") or []):
-        if isinstance(hook_dict, dict) and doctype in hook_dict:
-            return True
-    return False
+    # Hooks only change with a deploy (which restarts workers), so the set is
+    # computed once per site per process.
+    pdf_doctypes = _pdf_doctypes.get(frappe.local.site)
+    if pdf_doctypes is None:
+        pdf_doctypes = frozenset(
+            dt
+            for hook_dict in (frappe.get_hooks("attach_pdf_config") or [])
+            if isinstance(hook_dict, dict)
+            for dt in hook_dict
+        )
+        _pdf_doctypes[frappe.local.site] = pdf_doctypes
+    return doctype in pdf_doctypes
 
 
-def _run_whatsapp_notification_bg(doctype, docname, trigger_event):
+def _run_whatsapp_notification_bg(doctype, docname, trigger_event=None, trigger_events=None):
     """
-    RQ worker: reloads the document from DB and creates WhatsApp Queue entries.
+    RQ worker: reloads the document from DB and creates WhatsApp Queue entries
+    for every event the originating transaction fired on it (*trigger_event*
+    is kept for jobs chained from the PDF worker and already queued ones).
     Actual sending and retries are handled by the queue processor scheduler.
     """
-    import time
+    trigger_events = trigger_events or [trigger_event]
     try:
-        # Wait up to 6s for the doc to exist — BG job can start before the
-        # submit transaction commits (after_insert / on_update timing).
-        doc = None
-        for _ in range(3):
-            if frappe.db.exists(doctype, docname):
-                doc = frappe.get_doc(doctype, docname)
-                break
-            time.sleep(2)
-
-        if doc is None:
-            return  # doc never committed or was deleted — skip silently
+        # Only ever enqueued after the originating transaction commits, so a
+        # missing doc was deleted since — skip silently.
+        if not frappe.db.exists(doctype, docname):
+            return
+        doc = frappe.get_doc(doctype, docname)
 
-        _handle_whatsapp_notification(doc, None, trigger_event)
+        for event in trigger_events:
+            _handle_whatsapp_notification(doc, None, event)
 
     except Exception as e:
         frappe.log_error(
             title=f"WhatsApp BG Worker Error - {doctype}",
-            message=f"DocType: {doctype} | Name: {docname} | Event: {trigger_event}\n{str(e)}"
+            message=f"DocType: {doctype} | Name: {docname} | Events: {', '.join(trigger_events)}\n{str(e)}"
         )
 
 
@@ -1249,27 +2099,62 @@ def _enqueue_whatsapp_notification(doc, trigger_event):
     if doc.doctype in _EXCLUDED_DOCTYPES:
         return
 
+    # Only enqueue if there is actually an active WhatsApp Notification
+    # configured for this doctype + event. This prevents flooding the queue
+    # with jobs for every Frappe internal doctype (Prompt Template, Version,
+    # Communication, etc.) that has no notifications configured. Answered from
+    # the in-memory registry, so unrelated saves never touch the DB.
+    if not get_active_notifications(document_type=doc.doctype, event=trigger_event):
+        return
+
     # PDF-configured doctypes: WhatsApp is exclusively chained from the PDF
     # background job. Block ALL events here — on_submit, after_save, on_update
     # all fire during a submit and would create redundant jobs.
     if _doctype_has_pdf_config(doc.doctype):
         return
 
-    # Only enqueue if there is actually an active WhatsApp Notification
-    # configured for this doctype + event. This prevents flooding the queue
-    # with jobs for every Frappe internal doctype (Prompt Template, Version,
-    # Communication, etc.) that has no notifications configured.
-    if not get_active_notifications(document_type=doc.doctype, event=trigger_event):
-        return
+    # A submit fires on_update, after_save and on_submit: gather the events per
+    # document and enqueue one job for all of them once the transaction commits.
+    pending = frappe.flags.whatsapp_pending_events
+    if pending is None:
+        pending = frappe.flags.whatsapp_pending_events = {}
+        frappe.flags.whatsapp_pending_txn = frappe.generate_hash(length=10)
+        frappe.db.after_commit.add(_flush_whatsapp_events)
+        frappe.db.after_rollback.add(_reset_whatsapp_events)
+
+    events = pending.setdefault((doc.doctype, doc.name), [])
+    if trigger_event not in events:
+        events.append(trigger_event)
+
+
+def _flush_whatsapp_events():
+    """after_commit: one deduplicated job per (document, transaction)."""
+    pending = frappe.flags.whatsapp_pending_events or {}
+    txn = frappe.flags.whatsapp_pending_txn
+    _reset_whatsapp_events()
+
+    for (doctype, docname), events in pending.items():
+        try:
+            frappe.enqueue(
+                "techniti.whatsapp.whatsapp._run_whatsapp_notification_bg",
+                queue="short",
+                timeout=120,
+                job_id=f"whatsapp::{doctype}::{docname}::{txn}",
+                deduplicate=True,
+                doctype=doctype,
+                docname=docname,
+                trigger_events=events,
+            )
+        except Exception as e:
+            frappe.log_error(
+                title=f"WhatsApp Enqueue Error - {doctype}",
+                message=f"Name: {docname} | Events: {', '.join(events)}\n{str(e)}"
+            )
 
-    frappe.enqueue(
-        "techniti.whatsapp.whatsapp._run_whatsapp_notification_bg",
-        queue="short",
-        timeout=120,
-        doctype=doc.doctype,
-        docname=doc.name,
-        trigger_event=trigger_event,
-    )
+
+def _reset_whatsapp_events():
+    frappe.flags.whatsapp_pending_events = None
+    frappe.flags.whatsapp_pending_txn = None
 
 
 def handle_whatsapp_notification_submit(doc, method):
@@ -1343,9 +2228,13 @@ def _handle_whatsapp_notification(doc, method, trigger_event):
 # ============================================================================
 
 def send_scheduled_whatsapp_reminders_enhanced():
-    """Run daily: sends date-based reminder notifications"""
+    """
+    Run daily: coordinator only. Splits every date-based reminder into
+    name-range chunks and enqueues one job per notification and chunk
+    (see run_reminder_chunk); the last job to finish logs the run summary.
+    """
     settings = safe_get_settings()
-    if not settings or not settings.enabled:
+    if not settings or not settings.enabled or settings.use_reminder_schedule:
         return
 
     notifications = frappe.get_all(
@@ -1354,6 +2243,7 @@ def send_scheduled_whatsapp_reminders_enhanced():
         fields=["name"]
     )
 
+    chunks = []
     for notification_data in notifications:
         try:
             notification = frappe.get_doc(
@@ -1366,10 +2256,15 @@ def send_scheduled_whatsapp_reminders_enhanced():
                 )
                 continue
 
-            if '.' in notification.date_field:
-                process_child_table_reminders(notification)
-            else:
-                process_document_reminders(notification)
+            target_date = get_reminder_target_date(notification)
+            for after, until in get_reminder_chunks(notification, target_date):
+                chunks.append({
+                    "kind": "date",
+                    "notification": notification.name,
+                    "target_date": target_date,
+                    "after": after,
+                    "until": until,
+                })
 
         except Exception as e:
             frappe.log_error(
@@ -1377,346 +2272,1002 @@ def send_scheduled_whatsapp_reminders_enhanced():
                 "WhatsApp Scheduler Error"
             )
 
+    purge_reminder_cursors()
+    enqueue_reminder_run("Date reminders", chunks)
 
-def process_document_reminders(notification):
-    """Process document-level date-based reminders"""
-    date_field = notification.date_field
-
-    if notification.days_before:
-        target_date = add_days(nowdate(), notification.days_before)
-    elif notification.days_after:
-        target_date = add_days(nowdate(), -(notification.days_after))
-    else:
-        target_date = nowdate()
 
-    filters = {date_field: target_date}
+def process_document_reminders(notification):
+    """Process document-level date-based reminders, one page at a time"""
+    _run_date_reminders(notification, "Reminders", "WhatsApp Reminder Summary")
 
-    submittable_doctypes = [
-        "Purchase Order", "Sales Order", "Purchase Invoice",
-        "Sales Invoice", "Delivery Note", "Purchase Receipt"
-    ]
-    if notification.document_type in submittable_doctypes:
-        filters["docstatus"] = ["!=", 2]
 
-    try:
-        docs = frappe.get_all(
-            notification.document_type,
-            filters=filters,
-            fields=["name"]
-        )
-    except Exception as e:
+def process_child_table_reminders(notification):
+    """Process child-table date-based reminders (date_field uses 'table_field.date_field')"""
+    if '.' not in notification.date_field:
         frappe.log_error(
-            f"Error querying documents: {str(e)}",
-            f"WhatsApp Reminder Query - {notification.document_type}"
+            "Invalid child table field format. Use 'table_field.date_field'",
+            "WhatsApp Child Reminder Config Error"
         )
         return
 
-    handler = SparklebotHandler()
-    success_count = error_count = condition_skip_count = 0
-
-    for d in docs:
-        try:
-            doc = frappe.get_doc(notification.document_type, d.name)
-
-            if hasattr(doc, 'docstatus') and doc.docstatus == 2:
-                continue
-
-            if notification.condition:
-                if not evaluate_custom_condition(doc, notification.condition):
-                    condition_skip_count += 1
-                    continue
+    _run_date_reminders(notification, "Child reminders", "WhatsApp Child Reminder Summary")
 
-            recipients = process_notification_recipients(doc, notification)
-            if not recipients:
-                error_count += 1
-                continue
 
-            for recipient in recipients:
-                try:
-                    if _dispatch_message(handler, recipient, doc, notification,
-                                          target_date=target_date):
-                        success_count += 1
-                    else:
-                        error_count += 1
-                except Exception as send_error:
-                    error_count += 1
-                    frappe.log_error(
-                        f"Send failed to {recipient['source']}: {str(send_error)}",
-                        "WhatsApp Reminder Send Error"
-                    )
+def _run_date_reminders(notification, label, summary_title):
+    target_date = get_reminder_target_date(notification)
+    stats = frappe._dict(sent=0, errors=0, skipped=0)
 
-        except Exception as e:
-            frappe.log_error(
-                f"Failed to process reminder for {d.name}: {str(e)}",
-                "WhatsApp Reminder Error"
-            )
-            error_count += 1
+    process_reminder_range(notification, target_date, stats)
 
-    if success_count or error_count or condition_skip_count:
+    if stats.sent or stats.errors or stats.skipped:
         frappe.log_error(
-            f"Reminders for {notification.name} — "
-            f"Sent: {success_count}, Errors: {error_count}, "
-            f"Skipped: {condition_skip_count}",
-            f"WhatsApp Reminder Summary - {notification.document_type}"
+            f"{label} for {notification.name} — "
+            f"Sent: {stats.sent}, Errors: {stats.errors}, "
+            f"Skipped: {stats.skipped}",
+            f"{summary_title} - {notification.document_type}"
         )
 
 
-def process_child_table_reminders(notification):
-    """Process child-table date-based reminders (date_field uses 'table_field.date_field')"""
-    date_field = notification.date_field
+def get_reminder_target_date(notification):
+    """Date the reminder's date_field must equal for today's run"""
+    if notification.days_before:
+        return add_days(nowdate(), notification.days_before)
+    if notification.days_after:
+        return add_days(nowdate(), -(notification.days_after))
+    return nowdate()
 
-    if '.' not in date_field:
-        frappe.log_error(
-            "Invalid child table field format. Use 'table_field.date_field'",
-            "WhatsApp Child Reminder Config Error"
+
+# ============================================================================
+# REMINDER ENGINE — paged, column-pruned scans with batched lookups
+# ============================================================================
+
+# Documents fetched (and queued, in one commit) per page
+REMINDER_PAGE_SIZE = 500
+# WhatsApp Reminder Cursor rows of partially processed reminder ranges, and
+# how long they are kept
+REMINDER_CURSOR_KEY = "whatsapp_reminder_cursor"
+REMINDER_CURSOR_DAYS = 2
+
+# Always fetched: identity, cancellation and the usual user recipient fields
+_REMINDER_BASE_COLUMNS = ("name", "docstatus", "owner", "modified_by")
+
+_USER_RECIPIENT_FIELDS = ('owner', 'modified_by', 'assigned_to', 'created_by',
+                          'approved_by', 'submitted_by')
+
+
+def process_reminder_range(notification, target_date, stats, after=None, until=None):
+    """
+    Queue every page of a date-based reminder in (*after*, *until*].
+    Resumable: each page commits its cursor together with its queue rows, so
+    a rerun or retry of the same range continues after the last page that
+    committed.
+    """
+    try:
+        cursor_key = get_reminder_cursor_key(notification.name, target_date, after)
+        after = frappe.db.get_value("WhatsApp Reminder Cursor", cursor_key, "last_name") or after
+
+        while True:
+            after = process_reminder_page(notification, target_date, after, stats,
+                                          until=until, cursor_key=cursor_key)
+            if not after:
+                break
+    except Exception as e:
+        # One broken notification must not take the rest of the run with it
+        frappe.db.rollback()
+        stats.errors += 1
+        frappe.log_error(
+            f"Reminders for {notification.name} skipped: {str(e)}",
+            f"WhatsApp Reminder Error - {notification.document_type}"
         )
-        return
 
-    table_fieldname, child_date_field = date_field.split('.', 1)
 
-    if notification.days_before:
-        target_date = add_days(nowdate(), notification.days_before)
-    elif notification.days_after:
-        target_date = add_days(nowdate(), -(notification.days_after))
-    else:
-        target_date = nowdate()
+def get_reminder_cursor_key(notification, target_date, start=None):
+    """WhatsApp Reminder Cursor holding the last committed name of one reminder range"""
+    digest = hashlib.sha1(
+        f"{notification}\x1f{target_date}\x1f{start or ''}".encode()
+    ).hexdigest()[:20]
+    return f"{REMINDER_CURSOR_KEY}:{digest}"
+
+
+def purge_reminder_cursors():
+    """Drop cursors of ranges older than REMINDER_CURSOR_DAYS"""
+    frappe.db.delete("WhatsApp Reminder Cursor", {
+        "modified": ["<", add_days(nowdate(), -REMINDER_CURSOR_DAYS)],
+    })
+
+
+def process_reminder_page(notification, target_date, after, stats,
+                          page_size=REMINDER_PAGE_SIZE, until=None, cursor_key=None):
+    """
+    Queue one page of a date-based reminder: documents (or, for
+    'table.field' date fields, parents of child rows) dated *target_date*
+    with *after* < name <= *until*, in name order. Adds to *stats* (sent /
+    errors / skipped) and returns the page's last name, or None once nothing
+    is left. The last name is stored under *cursor_key* in the same
+    transaction as the page's queue rows.
+    """
+    doctype = notification.document_type
 
     try:
-        # Find parent docs that have a child row matching target_date
-        child_doctype = frappe.get_meta(notification.document_type)\
-                               .get_field(table_fieldname)\
-                               .options if frappe.get_meta(
-                                   notification.document_type
-                               ).get_field(table_fieldname) else None
-
-        if not child_doctype:
-            frappe.log_error(
-                f"Could not find child doctype for field {table_fieldname} "
-                f"in {notification.document_type}",
-                "WhatsApp Child Reminder Error"
-            )
-            return
+        if '.' in notification.date_field:
+            table_fieldname, child_date_field = notification.date_field.split('.', 1)
+            table_field = frappe.get_meta(doctype).get_field(table_fieldname)
+            if not table_field or not table_field.options:
+                frappe.log_error(
+                    f"Could not find child doctype for field {table_fieldname} "
+                    f"in {doctype}",
+                    "WhatsApp Child Reminder Error"
+                )
+                return None
 
-        parent_names = frappe.get_all(
-            child_doctype,
-            filters={child_date_field: target_date},
-            fields=["parent"],
-            distinct=True
+            filters = [
+                [child_date_field, "=", target_date],
+                ["parenttype", "=", doctype],
+                ["parentfield", "=", table_fieldname],
+            ]
+            if after:
+                filters.append(["parent", ">", after])
+            if until:
+                filters.append(["parent", "<=", until])
+            names = [row.parent for row in frappe.get_all(
+                table_field.options,
+                filters=filters,
+                fields=["parent"],
+                distinct=True,
+                order_by="parent asc",
+                limit_page_length=page_size,
+            )]
+            if not names:
+                return None
+            docs = load_reminder_docs(notification, [["name", "in", names]])
+            last = names[-1]
+        else:
+            filters = [[notification.date_field, "=", target_date]]
+            if after:
+                filters.append(["name", ">", after])
+            if until:
+                filters.append(["name", "<=", until])
+            docs = load_reminder_docs(notification, filters, page_size=page_size)
+            if not docs:
+                return None
+            last = docs[-1].name
+    except Exception as e:
+        frappe.log_error(
+            f"Error querying documents: {str(e)}",
+            f"WhatsApp Reminder Query - {doctype}"
         )
+        return None
 
-        handler = SparklebotHandler()
-        success_count = error_count = 0
+    if cursor_key:
+        _save_reminder_cursor(cursor_key, last)
+    queue_reminder_docs(notification, docs, stats, target_date=target_date)
+    frappe.db.commit()
+    return last
+
+
+def _save_reminder_cursor(cursor_key, last):
+    """Upsert a range cursor; left uncommitted for the caller's page commit"""
+    now = now_datetime()
+    user = frappe.session.user
+    frappe.db.delete("WhatsApp Reminder Cursor", {"name": cursor_key})
+    frappe.db.bulk_insert(
+        "WhatsApp Reminder Cursor",
+        ("name", "creation", "modified", "owner", "modified_by", "last_name"),
+        [(cursor_key, now, now, user, user, last)],
+    )
 
-        for row in parent_names:
-            try:
-                doc = frappe.get_doc(notification.document_type, row.parent)
 
-                if hasattr(doc, 'docstatus') and doc.docstatus == 2:
-                    continue
+def load_reminder_docs(notification, filters, page_size=None):
+    """
+    Documents of notification.document_type matching *filters* (cancelled
+    ones excluded), in name order. Only the columns the notification can read
+    are fetched and the documents are built from those rows; every other
+    column is present as None. A notification that reads a child table gets
+    fully loaded documents instead.
+    """
+    doctype = notification.document_type
+    meta = frappe.get_meta(doctype)
+    filters = [*filters, ["docstatus", "!=", 2]]
+    valid_columns = meta.get_valid_columns()
+    columns = _reminder_columns(notification, meta, valid_columns)
+
+    rows = frappe.get_all(
+        doctype,
+        filters=filters,
+        fields=columns or ["name"],
+        order_by="name asc",
+        limit_page_length=page_size or 0,
+    )
+
+    if columns is None:
+        return [frappe.get_doc(doctype, row.name) for row in rows]
+
+    blank = dict.fromkeys(valid_columns)
+    return [frappe.get_doc({**blank, **row, "doctype": doctype}) for row in rows]
+
 
+def queue_reminder_docs(notification, docs, stats, target_date=None, time_field=None):
+    """
+    Evaluate the condition, resolve recipients (assignee and user lookups
+    batched for the whole page) and bulk-insert queue rows for *docs*.
+    """
+    rows = get_reminder_queue_rows(notification, docs, stats, target_date=target_date,
+                                   time_field=time_field)
+    queued, failed = _flush_queue_rows(rows, "WhatsApp Reminder Send Error")
+    stats.sent += queued
+    stats.errors += failed
+
+
+def get_reminder_queue_rows(notification, docs, stats, target_date=None, time_field=None):
+    """The WhatsApp Queue rows queue_reminder_docs would insert for *docs*, not inserted"""
+    rows = []
+
+    try:
+        _prefetch_recipients(notification, docs)
+
+        for doc in docs:
+            try:
                 if notification.condition:
                     if not evaluate_custom_condition(doc, notification.condition):
+                        stats.skipped += 1
                         continue
 
                 recipients = process_notification_recipients(doc, notification)
                 if not recipients:
-                    error_count += 1
+                    stats.errors += 1
                     continue
 
-                for recipient in recipients:
-                    if _dispatch_message(handler, recipient, doc, notification,
-                                          target_date=target_date):
-                        success_count += 1
-                    else:
-                        error_count += 1
+                target_time = doc.get(time_field) if time_field else None
+                plan = _build_render_plan(doc, notification, target_date=target_date,
+                                          target_time=target_time)
+                rows.extend(_queue_rows(plan, recipients))
 
             except Exception as e:
                 frappe.log_error(
-                    f"Child reminder error for {row.parent}: {str(e)}",
-                    "WhatsApp Child Reminder Error"
+                    f"Failed to process reminder for {doc.name}: {str(e)}",
+                    "WhatsApp Reminder Error"
                 )
-                error_count += 1
+                stats.errors += 1
+    finally:
+        frappe.flags.whatsapp_assignee_phones = None
+        frappe.flags.whatsapp_user_phones = None
+
+    return rows
+
+
+def _prefetch_recipients(notification, docs):
+    """Load the assignee and user phones *docs* will ask for with one query each"""
+    if not docs:
+        return
+
+    recipient_fields = [
+        (recipient.receiver_by_document_field or "").strip().split('.')[0]
+        for recipient in (notification.recipients or [])
+    ]
+
+    if notification.send_to_all_assignees or "assigned_to" in recipient_fields:
+        doctype = docs[0].doctype
+        assigned = _assigned_phones(doctype, [doc.name for doc in docs])
+        frappe.flags.whatsapp_assignee_phones = {
+            (doctype, doc.name): assigned.get(doc.name, []) for doc in docs
+        }
+
+    user_fields = [
+        field for field in recipient_fields
+        if field in _USER_RECIPIENT_FIELDS and field != "assigned_to"
+    ]
+    if user_fields:
+        usernames = {doc.get(field) for doc in docs for field in user_fields} - {None, ""}
+        phones = _user_phones(usernames)
+        frappe.flags.whatsapp_user_phones = {user: phones.get(user) for user in usernames}
+
+
+def _reminder_columns(notification, meta, valid_columns):
+    """
+    Columns of the notification's doctype its condition, recipients, linked
+    documents and message can read, or None if any of them reads a child
+    table.
+    """
+    referenced = set(_REMINDER_BASE_COLUMNS)
+    referenced.update(_names_in_code(notification.condition))
+    referenced.update(("grand_total", "total"))  # default message amount
+
+    for fieldname in (notification.date_field, notification.time_field):
+        if fieldname:
+            referenced.add(fieldname.split('.')[0].strip())
+
+    for recipient in (notification.recipients or []):
+        referenced.update(_names_in_code(recipient.condition))
+        if recipient.receiver_by_document_field:
+            referenced.add(recipient.receiver_by_document_field.strip().split('.')[0])
+
+    linked_doctypes = {
+        linked.linked_doctype for linked in (notification.linked_documents or [])
+        if linked.linked_doctype
+    }
+    if linked_doctypes:
+        for df in meta.fields:
+            if df.fieldtype == "Link" and df.options in linked_doctypes:
+                referenced.add(df.fieldname)
+            elif df.fieldtype == "Dynamic Link":
+                referenced.update((df.fieldname, df.options))
+
+    template_doc = None
+    if notification.message:
+        try:
+            template_doc = frappe.get_cached_doc("WhatsApp Message Template", notification.message)
+        except frappe.DoesNotExistError:
+            pass  # rendered with the default message, like the event path
+    if template_doc and template_doc.is_active:
+        if template_doc.template_text:
+            referenced.update(
+                MessageTemplateHandler.compile_template(template_doc.template_text)[1::2]
+            )
+        for row in (template_doc.parameters or []):
+            if row.document_field:
+                referenced.add(row.document_field.strip())
+        if template_doc.header_document_field:
+            referenced.add(template_doc.header_document_field)
+
+    if referenced & {df.fieldname for df in meta.get_table_fields()}:
+        return None
+
+    return [column for column in valid_columns if column in referenced]
+
+
+def _names_in_code(code):
+    """Names, attribute names and string constants a Python expression mentions"""
+    names = set()
+    if not code or not code.strip():
+        return names
+
+    try:
+        tree = ast.parse(code.strip(), mode="eval")
+    except SyntaxError:
+        return names
 
-        if success_count or error_count:
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            names.add(node.id)
+        elif isinstance(node, ast.Attribute):
+            names.add(node.attr)
+        elif isinstance(node, ast.Constant) and isinstance(node.value, str):
+            names.add(node.value)
+    return names
+
+
+# ============================================================================
+# REMINDER RUNS — fan-out across RQ workers
+# ============================================================================
+
+# Dedicated worker queue for reminder chunks ("long" when not configured)
+REMINDER_QUEUE = "whatsapp_reminders"
+REMINDER_JOB_TIMEOUT = 1500
+# Redis hash per run: total / done job counts and per-notification tallies
+REMINDER_RUN_KEY = "whatsapp_reminder_run"
+REMINDER_RUN_TTL = 24 * 60 * 60
+
+
+def get_reminder_chunks(notification, target_date, chunk_size=REMINDER_PAGE_SIZE):
+    """
+    (after, until] name ranges of about *chunk_size* documents each covering
+    everything a date-based reminder will process on *target_date*.
+    """
+    doctype = notification.document_type
+
+    if '.' in notification.date_field:
+        table_fieldname, child_date_field = notification.date_field.split('.', 1)
+        table_field = frappe.get_meta(doctype).get_field(table_fieldname)
+        if not table_field or not table_field.options:
             frappe.log_error(
-                f"Child reminders for {notification.name} — "
-                f"Sent: {success_count}, Errors: {error_count}",
-                f"WhatsApp Child Reminder Summary - {notification.document_type}"
+                f"Could not find child doctype for field {table_fieldname} "
+                f"in {doctype}",
+                "WhatsApp Child Reminder Error"
             )
+            return []
+        names = frappe.get_all(
+            table_field.options,
+            filters={
+                child_date_field: target_date,
+                "parenttype": doctype,
+                "parentfield": table_fieldname,
+            },
+            pluck="parent",
+            distinct=True,
+            order_by="parent asc",
+        )
+    else:
+        names = frappe.get_all(
+            doctype,
+            filters={notification.date_field: target_date, "docstatus": ["!=", 2]},
+            pluck="name",
+            order_by="name asc",
+        )
 
+    return [
+        (names[start - 1] if start else None, names[min(start + chunk_size, len(names)) - 1])
+        for start in range(0, len(names), chunk_size)
+    ]
+
+
+def enqueue_reminder_run(label, chunks):
+    """Register a run of *chunks* and enqueue one run_reminder_chunk job each"""
+    if not chunks:
+        return
+
+    run_id = frappe.generate_hash(length=10)
+    cache = frappe.cache()
+    key = cache.make_key(f"{REMINDER_RUN_KEY}:{run_id}")
+    pipe = cache.pipeline()
+    pipe.hset(key, mapping={"label": label, "total": len(chunks), "done": 0})
+    pipe.expire(key, REMINDER_RUN_TTL)
+    pipe.execute()
+
+    queue = _reminder_queue()
+    for index, chunk in enumerate(chunks):
+        frappe.enqueue(
+            "techniti.whatsapp.whatsapp.run_reminder_chunk",
+            queue=queue,
+            timeout=REMINDER_JOB_TIMEOUT,
+            job_id=f"whatsapp_reminder::{run_id}::{index}",
+            deduplicate=True,
+            run_id=run_id,
+            **chunk,
+        )
+
+
+def run_reminder_chunk(run_id, kind, notification, target_date=None,
+                       after=None, until=None):
+    """RQ job: one notification's chunk of a reminder run"""
+    stats = frappe._dict(sent=0, errors=0, skipped=0)
+    try:
+        notification_doc = frappe.get_doc("WhatsApp Notification", notification)
+        if kind == "time":
+            process_time_based_reminders(notification_doc, stats)
+        else:
+            process_reminder_range(notification_doc, target_date, stats,
+                                   after=after, until=until)
     except Exception as e:
+        stats.errors += 1
+        frappe.log_error(
+            f"Reminder chunk failed for {notification} ({after} .. {until}): {str(e)}",
+            "WhatsApp Scheduler Error"
+        )
+    finally:
+        _record_reminder_progress(run_id, notification, stats)
+
+
+def _record_reminder_progress(run_id, notification, stats):
+    """Add a finished chunk's counts to its run; the last chunk logs the summary"""
+    cache = frappe.cache()
+    key = cache.make_key(f"{REMINDER_RUN_KEY}:{run_id}")
+
+    pipe = cache.pipeline()
+    for counter in ("sent", "errors", "skipped"):
+        pipe.hincrby(key, f"{notification}|{counter}", stats[counter])
+    pipe.hincrby(key, "done", 1)
+    pipe.hget(key, "total")
+    *_, done, total = pipe.execute()
+    if not total or done < int(total):
+        return
+
+    # HINCRBY is atomic, so exactly one chunk sees done == total
+    pipe = cache.pipeline()
+    pipe.hgetall(key)
+    pipe.delete(key)
+    run = {k.decode(): v.decode() for k, v in pipe.execute()[0].items()}
+
+    totals = dict.fromkeys(("sent", "errors", "skipped"), 0)
+    per_notification = {}
+    for field, value in run.items():
+        if "|" not in field:
+            continue
+        name, counter = field.rsplit("|", 1)
+        per_notification.setdefault(name, {})[counter] = value
+        totals[counter] += int(value)
+
+    if any(totals.values()):
         frappe.log_error(
-            f"Child table reminder failed for {notification.name}: {str(e)}",
-            "WhatsApp Child Reminder Error"
+            f"{run.get('label', 'Reminders')} run {run_id} ({int(total)} jobs) — "
+            f"Sent: {totals['sent']}, Errors: {totals['errors']}, "
+            f"Skipped: {totals['skipped']}\n"
+            + "\n".join(
+                f"{name} — Sent: {counts.get('sent', 0)}, Errors: {counts.get('errors', 0)}, "
+                f"Skipped: {counts.get('skipped', 0)}"
+                for name, counts in sorted(per_notification.items())
+            ),
+            "WhatsApp Reminder Summary"
         )
 
 
+def _reminder_queue():
+    from frappe.utils.background_jobs import get_queues_timeout
+
+    return REMINDER_QUEUE if REMINDER_QUEUE in get_queues_timeout() else "long"
+
+
 # ============================================================================
-# SCHEDULED REMINDERS — TIME-BASED (hourly cron)
+# REMINDER SCHEDULE — materialised fire times (WhatsApp Setting switch)
 # ============================================================================
 
-def process_scheduled_whatsapp_time_reminders():
-    """Run hourly: sends time-based reminder notifications"""
+# Date-based reminders fire at the time the daily cron used to run
+REMINDER_FIRE_TIME = time(11, 0)
+# Due schedule rows claimed (and queued, in one commit) per notification page
+SCHEDULE_DRAIN_SIZE = 500
+# A page that fails to queue is retried after this many minutes, and dropped
+# once its rows are more than SCHEDULE_GIVE_UP_HOURS overdue
+SCHEDULE_RETRY_MINUTES = 15
+SCHEDULE_GIVE_UP_HOURS = 24
+
+_SCHEDULE_INSERT_FIELDS = (
+    "name", "creation", "modified", "owner", "modified_by",
+    "notification", "reference_doctype", "reference_name", "fire_at",
+)
+
+
+def reminder_schedule_enabled():
     settings = safe_get_settings()
-    if not settings or not settings.enabled:
+    return bool(settings and settings.enabled and settings.use_reminder_schedule)
+
+
+def sync_reminder_schedule(doc, method=None):
+    """
+    doc_event (*): replace the document's WhatsApp Scheduled Send rows with
+    its current fire times, for every Scheduled Reminder notification on its
+    doctype. Cancelled and deleted documents just lose their rows.
+    """
+    if doc.doctype in _EXCLUDED_DOCTYPES:
         return
 
-    notifications = frappe.get_all(
-        "WhatsApp Notification",
-        filters={"enabled": 1, "event": "Scheduled Reminder", "add_timing": 1},
-        fields=["name"]
+    names = get_notification_registry().get((doc.doctype, "Scheduled Reminder"))
+    if not names or not reminder_schedule_enabled():
+        return
+
+    frappe.db.delete(
+        "WhatsApp Scheduled Send",
+        {"reference_doctype": doc.doctype, "reference_name": doc.name},
     )
-    if not notifications:
+    if method == "on_trash" or doc.docstatus == 2:
         return
 
-    for notification_data in notifications:
-        try:
-            notification = frappe.get_doc(
-                "WhatsApp Notification", notification_data.name
+    rows = []
+    for name in names:
+        notification = frappe.get_cached_doc("WhatsApp Notification", name)
+        if not notification.date_field:
+            continue
+        dates, time_value = _reminder_dates(notification, doc)
+        rows.extend(
+            (name, doc.doctype, doc.name, fire_at)
+            for fire_at in get_reminder_fire_times(notification, dates, time_value)
+        )
+    _insert_schedule_rows(rows)
+
+
+def get_reminder_fire_times(notification, dates, time_value=None):
+    """
+    Upcoming fire times of a notification for a document whose date_field
+    holds *dates* (several for a child-table date field): date-based
+    reminders at REMINDER_FIRE_TIME on the day the daily run would have
+    matched, time-based ones hours_before the document's time on that date
+    (no earlier than its midnight, and right away when already inside the
+    window).
+    """
+    now = now_datetime()
+    fire_times = set()
+
+    for value in dates:
+        if not value:
+            continue
+        day = frappe.utils.getdate(value)
+
+        if notification.add_timing:
+            try:
+                if isinstance(time_value, datetime):
+                    moment = time_value
+                else:
+                    moment = datetime.combine(day, frappe.utils.get_time(time_value))
+            except Exception:
+                continue
+            if not time_value or moment < now:
+                continue
+            fire_at = max(
+                moment - timedelta(hours=frappe.utils.cint(notification.hours_before)),
+                datetime.combine(day, time.min),
+                now,
             )
-            if not notification.time_field or not notification.hours_before:
-                frappe.log_error(
-                    f"Incomplete time config for {notification.name}",
-                    "WhatsApp Time Config Error"
-                )
+            if fire_at.date() != day:
+                continue
+        else:
+            if notification.days_before:
+                day = frappe.utils.getdate(add_days(day, -notification.days_before))
+            elif notification.days_after:
+                day = frappe.utils.getdate(add_days(day, notification.days_after))
+            fire_at = datetime.combine(day, REMINDER_FIRE_TIME)
+            if fire_at < now:
                 continue
 
-            process_time_based_reminders(notification)
+        fire_times.add(fire_at)
 
+    return sorted(fire_times)
+
+
+def process_reminder_schedule():
+    """
+    Run every minute while the schedule is enabled: queue every reminder
+    whose fire_at has passed. Rows are claimed per notification with
+    FOR UPDATE SKIP LOCKED and deleted in the same transaction as the queue
+    rows they produce; a page that fails is deferred by
+    SCHEDULE_RETRY_MINUTES.
+    """
+    if not reminder_schedule_enabled():
+        return
+
+    now = now_datetime()
+    for name in frappe.db.sql_list(
+        """
+        SELECT DISTINCT notification FROM `tabWhatsApp Scheduled Send`
+        WHERE fire_at <= %(now)s
+          AND (retry_after IS NULL OR retry_after <= %(now)s)
+        """,
+        {"now": now},
+    ):
+        try:
+            notification = frappe.get_doc("WhatsApp Notification", name)
+            while _fire_reminder_page(notification, now):
+                pass
         except Exception as e:
+            frappe.db.rollback()
             frappe.log_error(
-                f"Time reminder failed for {notification_data.name}: {str(e)}",
-                "WhatsApp Time Reminder Error"
+                f"Scheduled reminders failed for {name}: {str(e)}",
+                "WhatsApp Scheduler Error"
             )
 
 
-def process_time_based_reminders(notification):
-    """Process one time-based notification"""
-    current_datetime = now_datetime()
-    current_date = current_datetime.date()
-
-    target_start_time = current_datetime
-    target_end_time = add_to_date(current_datetime, hours=notification.hours_before)
-
-    date_filters = {notification.date_field: current_date}
-    submittable_doctypes = [
-        "Purchase Order", "Sales Order", "Purchase Invoice",
-        "Sales Invoice", "Delivery Note", "Purchase Receipt"
-    ]
-    if notification.document_type in submittable_doctypes:
-        date_filters["docstatus"] = ["!=", 2]
+def _fire_reminder_page(notification, now):
+    """
+    Claim, delete and queue one page of a notification's due rows in a
+    single transaction. Returns True while a full page was queued, False
+    once none are left or the page failed (and was deferred).
+    """
+    due = frappe.db.sql(
+        """
+        SELECT name, reference_name, fire_at FROM `tabWhatsApp Scheduled Send`
+        WHERE notification = %(notification)s AND fire_at <= %(now)s
+          AND (retry_after IS NULL OR retry_after <= %(now)s)
+        ORDER BY fire_at
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+        """,
+        {"notification": notification.name, "now": now, "limit": SCHEDULE_DRAIN_SIZE},
+        as_dict=True,
+    )
+    if not due:
+        return False
 
     try:
-        docs = frappe.get_all(
-            notification.document_type,
-            filters=date_filters,
-            fields=["name", notification.time_field]
-        )
+        frappe.db.delete("WhatsApp Scheduled Send", {"name": ["in", [row.name for row in due]]})
+
+        rows = []
+        if notification.enabled and notification.event == "Scheduled Reminder":
+            # One render target per fire day, as the daily / hourly runs had
+            by_day = {}
+            for row in due:
+                by_day.setdefault(row.fire_at.date(), set()).add(row.reference_name)
+
+            stats = frappe._dict(sent=0, errors=0, skipped=0)
+            for day, names in by_day.items():
+                if notification.add_timing:
+                    target_date, time_field = day, notification.time_field
+                else:
+                    target_date, time_field = _scheduled_target_date(notification, day), None
+                docs = load_reminder_docs(notification, [["name", "in", list(names)]])
+                rows.extend(get_reminder_queue_rows(notification, docs, stats,
+                                                    target_date=target_date,
+                                                    time_field=time_field))
+
+        # Commits the claim, the delete and every queue row together
+        _bulk_insert_queue_rows(rows)
+        frappe.db.commit()
     except Exception as e:
+        frappe.db.rollback()
+        _defer_schedule_rows(due, now)
         frappe.log_error(
-            f"Error querying documents: {str(e)}",
-            f"WhatsApp Time Query Error - {notification.document_type}"
+            f"Scheduled reminders for {notification.name} failed, "
+            f"{len(due)} row(s) deferred: {str(e)}",
+            "WhatsApp Scheduler Error"
         )
-        return
+        return False
+
+    return len(due) == SCHEDULE_DRAIN_SIZE
+
+
+def _defer_schedule_rows(due, now):
+    """Retry a failed page after SCHEDULE_RETRY_MINUTES; drop rows overdue past SCHEDULE_GIVE_UP_HOURS"""
+    give_up = now - timedelta(hours=SCHEDULE_GIVE_UP_HOURS)
+    expired = [row.name for row in due if row.fire_at < give_up]
+    retry = [row.name for row in due if row.fire_at >= give_up]
+
+    if expired:
+        frappe.db.delete("WhatsApp Scheduled Send", {"name": ["in", expired]})
+    if retry:
+        frappe.db.sql(
+            """
+            UPDATE `tabWhatsApp Scheduled Send`
+            SET retry_after = %(retry_after)s
+            WHERE name IN %(names)s
+            """,
+            {
+                "names": tuple(retry),
+                "retry_after": now + timedelta(minutes=SCHEDULE_RETRY_MINUTES),
+            },
+        )
+    frappe.db.commit()
+
+
+def _scheduled_target_date(notification, fire_day):
+    """The date_field value a date-based reminder firing on *fire_day* is for"""
+    if notification.days_before:
+        return add_days(fire_day, notification.days_before)
+    if notification.days_after:
+        return add_days(fire_day, -(notification.days_after))
+    return fire_day
+
+
+def rebuild_reminder_schedule(notification=None):
+    """
+    Rebuild WhatsApp Scheduled Send from the source documents for one or
+    every Scheduled Reminder notification — enqueued when the schedule is
+    switched on and when such a notification is saved.
 
-    handler = SparklebotHandler()
-    success_count = error_count = condition_skip_count = time_skip_count = 0
+        bench execute techniti.whatsapp.whatsapp.rebuild_reminder_schedule
+    """
+    names = [notification] if notification else frappe.get_all(
+        "WhatsApp Notification", filters={"event": "Scheduled Reminder"}, pluck="name"
+    )
 
-    for d in docs:
+    for name in names:
         try:
-            doc = frappe.get_doc(notification.document_type, d.name)
+            frappe.db.delete("WhatsApp Scheduled Send", {"notification": name})
+            notification_doc = frappe.get_doc("WhatsApp Notification", name)
+            if (notification_doc.enabled
+                    and notification_doc.event == "Scheduled Reminder"
+                    and notification_doc.date_field
+                    and reminder_schedule_enabled()):
+                _backfill_reminder_schedule(notification_doc)
+            frappe.db.commit()
+        except Exception as e:
+            frappe.db.rollback()
+            frappe.log_error(
+                f"Could not rebuild the reminder schedule for {name}: {str(e)}",
+                "WhatsApp Scheduler Error"
+            )
 
-            if hasattr(doc, 'docstatus') and doc.docstatus == 2:
-                continue
 
-            time_field_value = getattr(doc, notification.time_field, None)
-            if not time_field_value:
-                time_skip_count += 1
-                continue
+def clear_reminder_schedule(notification):
+    """Drop a notification's schedule rows (on delete)"""
+    frappe.db.delete("WhatsApp Scheduled Send", {"notification": notification})
 
-            if not is_time_in_range(time_field_value, target_start_time, target_end_time):
-                time_skip_count += 1
-                continue
 
-            if notification.condition:
-                if not evaluate_custom_condition(doc, notification.condition):
-                    condition_skip_count += 1
-                    continue
+def _backfill_reminder_schedule(notification):
+    doctype = notification.document_type
+    # Earliest date_field value that can still fire
+    if notification.add_timing:
+        since = nowdate()
+    elif notification.days_before:
+        since = add_days(nowdate(), notification.days_before)
+    elif notification.days_after:
+        since = add_days(nowdate(), -(notification.days_after))
+    else:
+        since = nowdate()
 
-            recipients = process_notification_recipients(doc, notification)
-            if not recipients:
-                error_count += 1
-                continue
+    if '.' in notification.date_field:
+        table_fieldname, child_date_field = notification.date_field.split('.', 1)
+        table_field = frappe.get_meta(doctype).get_field(table_fieldname)
+        if not table_field or not table_field.options:
+            return
+        dates_by_parent = {}
+        for row in frappe.get_all(
+            table_field.options,
+            filters={
+                child_date_field: [">=", since],
+                "parenttype": doctype,
+                "parentfield": table_fieldname,
+            },
+            fields=["parent", child_date_field],
+        ):
+            dates_by_parent.setdefault(row.parent, []).append(row.get(child_date_field))
+
+        _insert_schedule_rows([
+            (notification.name, doctype, parent, fire_at)
+            for parent, dates in dates_by_parent.items()
+            for fire_at in get_reminder_fire_times(notification, dates)
+        ])
+        return
 
-            for recipient in recipients:
-                try:
-                    if _dispatch_message(handler, recipient, doc, notification,
-                                          target_date=current_date,
-                                          target_time=time_field_value):
-                        success_count += 1
-                    else:
-                        error_count += 1
-                except Exception as send_error:
-                    error_count += 1
-                    frappe.log_error(
-                        f"Send failed to {recipient['source']}: {str(send_error)}",
-                        "WhatsApp Time Send Error"
-                    )
+    fields = ["name", notification.date_field]
+    if notification.add_timing and notification.time_field:
+        fields.append(notification.time_field)
+
+    after = None
+    while True:
+        filters = [[notification.date_field, ">=", since], ["docstatus", "!=", 2]]
+        if after:
+            filters.append(["name", ">", after])
+        rows = frappe.get_all(
+            doctype,
+            filters=filters,
+            fields=fields,
+            order_by="name asc",
+            limit_page_length=REMINDER_PAGE_SIZE,
+        )
+        if not rows:
+            break
+
+        _insert_schedule_rows([
+            (notification.name, doctype, row.name, fire_at)
+            for row in rows
+            for fire_at in get_reminder_fire_times(
+                notification, *_reminder_dates(notification, row)
+            )
+        ])
+        after = rows[-1].name
 
-        except Exception as e:
+
+def _reminder_dates(notification, doc):
+    """(date_field values, time_field value) of a document or row"""
+    if '.' in notification.date_field:
+        table_fieldname, child_date_field = notification.date_field.split('.', 1)
+        dates = [row.get(child_date_field) for row in (doc.get(table_fieldname) or [])]
+    else:
+        dates = [doc.get(notification.date_field)]
+
+    time_value = doc.get(notification.time_field) \
+        if notification.add_timing and notification.time_field else None
+    return dates, time_value
+
+
+def _insert_schedule_rows(rows):
+    """rows: (notification, reference_doctype, reference_name, fire_at) tuples"""
+    if not rows:
+        return
+
+    now = now_datetime()
+    user = frappe.session.user
+    frappe.db.bulk_insert(
+        "WhatsApp Scheduled Send",
+        _SCHEDULE_INSERT_FIELDS,
+        [(frappe.generate_hash(length=10), now, now, user, user, *row) for row in rows],
+    )
+
+
+# ============================================================================
+# SCHEDULED REMINDERS — TIME-BASED (hourly cron)
+# ============================================================================
+
+def process_scheduled_whatsapp_time_reminders():
+    """Run hourly: coordinator only — one job per time-based notification"""
+    settings = safe_get_settings()
+    if not settings or not settings.enabled or settings.use_reminder_schedule:
+        return
+
+    notifications = frappe.get_all(
+        "WhatsApp Notification",
+        filters={"enabled": 1, "event": "Scheduled Reminder", "add_timing": 1},
+        fields=["name", "time_field", "hours_before"]
+    )
+    if not notifications:
+        return
+
+    chunks = []
+    for notification in notifications:
+        if not notification.time_field or not notification.hours_before:
             frappe.log_error(
-                f"Failed to process time reminder for {d.name}: {str(e)}",
-                f"WhatsApp Time Processing Error - {notification.document_type}"
+                f"Incomplete time config for {notification.name}",
+                "WhatsApp Time Config Error"
             )
-            error_count += 1
+            continue
+        chunks.append({"kind": "time", "notification": notification.name})
+
+    enqueue_reminder_run("Time reminders", chunks)
+
+
+def process_time_based_reminders(notification, stats=None):
+    """
+    Process one time-based notification. Counts go into *stats* when given
+    (a reminder run logs one summary), otherwise a summary is logged here.
+
+    Only documents dated today whose time falls in [now, now + hours_before]
+    are ever loaded: the window is applied in SQL, a page at a time.
+    """
+    run_stats = frappe._dict(sent=0, errors=0, skipped=0)
+    doctype = notification.document_type
+
+    current_datetime = now_datetime()
+    current_date = current_datetime.date()
+    target_end_time = add_to_date(current_datetime, hours=notification.hours_before)
 
-    if success_count or error_count or condition_skip_count or time_skip_count:
+    moment = _reminder_moment_sql(notification)
+    if not moment:
         frappe.log_error(
-            f"Time reminders for {notification.name} — "
-            f"Sent: {success_count}, Errors: {error_count}, "
-            f"Condition Skips: {condition_skip_count}, Time Skips: {time_skip_count}",
-            f"WhatsApp Time Summary - {notification.document_type}"
+            f"date_field '{notification.date_field}' / time_field "
+            f"'{notification.time_field}' are not columns of {doctype}",
+            "WhatsApp Time Config Error"
         )
+        return
+
+    after = None
+    while True:
+        try:
+            names = frappe.db.sql_list(
+                f"""
+                SELECT name FROM `tab{doctype}`
+                WHERE `{notification.date_field}` = %(date)s
+                    AND docstatus != 2
+                    AND {moment} BETWEEN %(start)s AND %(end)s
+                    {"AND name > %(after)s" if after else ""}
+                ORDER BY name
+                LIMIT %(limit)s
+                """,
+                {
+                    "date": current_date,
+                    "start": current_datetime,
+                    "end": target_end_time,
+                    "after": after,
+                    "limit": REMINDER_PAGE_SIZE,
+                },
+            )
+        except Exception as e:
+            frappe.log_error(
+                f"Error querying documents: {str(e)}",
+                f"WhatsApp Time Query Error - {doctype}"
+            )
+            break
 
+        if not names:
+            break
 
-def is_time_in_range(time_field_value, start_datetime, end_datetime):
-    """Check if a time value falls within [start_datetime, end_datetime]"""
-    try:
-        if isinstance(time_field_value, datetime):
-            appointment_datetime = time_field_value
-        elif isinstance(time_field_value, time):
-            appointment_datetime = datetime.combine(
-                start_datetime.date(), time_field_value
+        try:
+            docs = load_reminder_docs(notification, [["name", "in", names]])
+            queue_reminder_docs(notification, docs, run_stats, target_date=current_date,
+                                time_field=notification.time_field)
+        except Exception as e:
+            frappe.db.rollback()
+            run_stats.errors += 1
+            frappe.log_error(
+                f"Time reminders for {notification.name} skipped: {str(e)}",
+                f"WhatsApp Time Processing Error - {doctype}"
             )
-        elif isinstance(time_field_value, timedelta):
-            midnight = datetime.combine(start_datetime.date(), time.min)
-            appointment_datetime = midnight + time_field_value
-        elif isinstance(time_field_value, str):
-            try:
-                parsed_time = datetime.strptime(time_field_value, "%H:%M").time()
-                appointment_datetime = datetime.combine(
-                    start_datetime.date(), parsed_time
-                )
-            except ValueError:
-                try:
-                    appointment_datetime = datetime.strptime(
-                        time_field_value, "%Y-%m-%d %H:%M:%S"
-                    )
-                except ValueError:
-                    parts = time_field_value.split(':')
-                    if len(parts) >= 2:
-                        h, m = int(parts[0]), int(parts[1])
-                        s = int(parts[2]) if len(parts) > 2 else 0
-                        appointment_datetime = datetime.combine(
-                            start_datetime.date(), time(h, m, s)
-                        )
-                    else:
-                        return False
-        else:
-            return False
+            break
+        after = names[-1]
 
-        return start_datetime <= appointment_datetime <= end_datetime
+    if stats is not None:
+        stats.sent += run_stats.sent
+        stats.errors += run_stats.errors
+        stats.skipped += run_stats.skipped
+        return
 
-    except Exception as e:
-        frappe.log_error(f"Error checking time range: {str(e)}", "WhatsApp Time Range Error")
-        return False
+    if run_stats.sent or run_stats.errors or run_stats.skipped:
+        frappe.log_error(
+            f"Time reminders for {notification.name} — "
+            f"Sent: {run_stats.sent}, Errors: {run_stats.errors}, "
+            f"Condition Skips: {run_stats.skipped}",
+            f"WhatsApp Time Summary - {doctype}"
+        )
+
+
+def _reminder_moment_sql(notification):
+    """
+    SQL expression for a document's reminder moment: a Datetime time_field as
+    is, otherwise its time on the date_field's date. None if either field is
+    not a column of the doctype (field names are interpolated into SQL).
+    """
+    meta = frappe.get_meta(notification.document_type)
+    valid_columns = set(meta.get_valid_columns())
+    date_field, time_field = notification.date_field, notification.time_field
+    if date_field not in valid_columns or time_field not in valid_columns:
+        return None
+
+    time_df = meta.get_field(time_field)
+    if time_df and time_df.fieldtype == "Datetime":
+        return f"`{time_field}`"
+    return f"TIMESTAMP(DATE(`{date_field}`), `{time_field}`)"